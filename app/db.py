@@ -1,6 +1,6 @@
 
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 
 # Datenbankpfad-Priorität:
@@ -26,7 +26,40 @@ else:
 
 DB_URL = f"sqlite:///{db_path}"
 
-engine = create_engine(DB_URL, echo=False, future=True)
+# Pool groß genug für Request-Threads plus Hintergrund-Worker (Benachrichtigungen),
+# damit niemand auf eine freie Verbindung warten muss (Default: 5 + 10 Overflow)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+
+engine = create_engine(DB_URL, echo=False, future=True, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+
+# WAL + synchronous=FULL als Default: gilt für alle Tabellen, auch TimeLog/Abrechnung.
+# SQLITE_SYNCHRONOUS=NORMAL lockert das global (bei Stromausfall können die letzten Commits fehlen);
+# für die idempotenten Benachrichtigungs-Stempel senkt relax_sync() es nur für den einen Commit
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "FULL").upper()
+_SYNC_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+@event.listens_for(engine, "connect")
+def _sqlite_pragmas(dbapi_conn, _record):
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    if SQLITE_SYNCHRONOUS in _SYNC_MODES:
+        cur.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cur.close()
+
+@event.listens_for(engine, "checkin")
+def _restore_synchronous(dbapi_conn, record):
+    # Verbindung zurück im Pool -> gelockertes synchronous wieder auf den Default setzen
+    if record.info.pop("relaxed_sync", False):
+        cur = dbapi_conn.cursor()
+        cur.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS if SQLITE_SYNCHRONOUS in _SYNC_MODES else 'FULL'}")
+        cur.close()
+
+def relax_sync(session):
+    """synchronous=NORMAL nur für die aktuelle Transaktion der Session (bis die Verbindung zurück in den Pool geht)."""
+    conn = session.connection()
+    conn.exec_driver_sql("PRAGMA synchronous=NORMAL")
+    conn.info["relaxed_sync"] = True
 
 class Base(DeclarativeBase):
     pass
@@ -118,3 +151,8 @@ CREATE TABLE IF NOT EXISTS push_subscriptions (
             msg = str(e).lower()
             if "already exists" not in msg:
                 pass
+        # Indizes für bestehende DBs (create_all legt sie nur bei neuen Tabellen an)
+        conn.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_tasks_pending_notify ON tasks (assignment_status, assigned_staff_id, assign_notified_at)"
+        )
+        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_tasks_date ON tasks (date)")
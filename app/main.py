@@ -1,52 +1,59 @@
-import os, json, datetime as dt, csv, io, logging
+import os, json, datetime as dt, csv, io, logging, asyncio, smtplib, calendar, threading
+import orjson
+from functools import lru_cache
+from itertools import groupby
+from contextlib import contextmanager
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
 from typing import List, Optional, Dict
 from fastapi import FastAPI, Request, Depends, Form, HTTPException, Query
-from fastapi.responses import RedirectResponse, StreamingResponse, PlainTextResponse, HTMLResponse, JSONResponse, Response
+from fastapi.responses import RedirectResponse, StreamingResponse, PlainTextResponse, HTMLResponse, ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from datetime import date as _date, datetime as _dt, timedelta as _td
+from jinja2 import Template
+from sqlalchemy import func, insert
+from sqlalchemy.orm import load_only, selectinload
 from pywebpush import webpush, WebPushException
-
-from .db import init_db, SessionLocal
+from py_vapid import Vapid
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError as _RequestsConnectionError
+from urllib3.exceptions import ConnectTimeoutError
+try:
+    from twilio.rest import Client as _TwilioClient
+    from twilio.http.http_client import TwilioHttpClient as _TwilioHttpClient
+    from twilio.base.exceptions import TwilioRestException
+except ImportError:  # WhatsApp ist optional
+    _TwilioClient = _TwilioHttpClient = TwilioRestException = None
+
+from .db import init_db, SessionLocal, relax_sync
 from .models import Booking, Staff, Apartment, Task, TimeLog, TaskSeries, PushSubscription
 from .services_smoobu import SmoobuClient
 from .utils import new_token, today_iso, now_iso
 from .sync import upsert_tasks_from_bookings
 
+_SUPPORTED = frozenset(("de", "en", "fr", "it", "es", "ro", "ru", "bg"))
+
 def detect_language(request: Request) -> str:
     """Erkenne Browser-Sprache aus Cookie, Query-Parameter oder Accept-Language Header"""
-    # Zuerst Cookie überprüfen
-    lang_cookie = request.cookies.get("lang", "")
-    if lang_cookie in ["de", "en", "fr", "it", "es", "ro", "ru", "bg"]:
-        return lang_cookie
-    
-    # Dann Query-Parameter überprüfen
-    lang_query = request.query_params.get("lang", "")
-    if lang_query in ["de", "en", "fr", "it", "es", "ro", "ru", "bg"]:
-        return lang_query
+    # Zuerst Cookie, dann Query-Parameter überprüfen
+    for src in (request.cookies.get("lang", ""), request.query_params.get("lang", "")):
+        if src in _SUPPORTED:
+            return src
     
-    # Dann Accept-Language Header
-    accept_lang = request.headers.get("accept-language", "de").lower()
-    if "en" in accept_lang:
-        return "en"
-    elif "fr" in accept_lang:
-        return "fr"
-    elif "it" in accept_lang:
-        return "it"
-    elif "es" in accept_lang:
-        return "es"
-    elif "ro" in accept_lang:
-        return "ro"
-    elif "ru" in accept_lang:
-        return "ru"
-    elif "bg" in accept_lang:
-        return "bg"
+    # Dann Accept-Language Header (z. B. "en-US;q=0.9, de;q=0.8") in Präferenz-Reihenfolge
+    for part in request.headers.get("accept-language", "").split(","):
+        tag = part.split(";", 1)[0].strip()[:2].lower()
+        if tag in _SUPPORTED:
+            return tag
     return "de"  # Default: Deutsch
 
+@lru_cache(maxsize=8)
 def get_translations(lang: str) -> Dict[str, str]:
-    """Übersetzungen für verschiedene Sprachen"""
+    """Übersetzungen für verschiedene Sprachen (gecacht, Rückgabe nicht verändern)"""
     translations = {
                "de": {
                    "tasks": "Einsätze", "team": "Team", "apartments": "Apartments", "import_now": "Import jetzt",
@@ -255,26 +262,32 @@ ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 TIMEZONE = os.getenv("TIMEZONE", "Europe/Berlin")
 REFRESH_INTERVAL_MINUTES = int(os.getenv("REFRESH_INTERVAL_MINUTES", "60"))
 BASE_URL = os.getenv("BASE_URL", "")
+PUBLIC_BASE_URL = BASE_URL.rstrip("/")  # einmal normalisiert für Links in Jobs/Nachrichten
 SMTP_HOST = os.getenv("SMTP_HOST", "")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
 SMTP_USER = os.getenv("SMTP_USER", "")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
 SMTP_FROM = os.getenv("SMTP_FROM", "")
+SMTP_ENABLED = bool(SMTP_HOST and SMTP_FROM)
 # WhatsApp/Twilio Configuration
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID", "")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN", "")
 TWILIO_WHATSAPP_FROM = os.getenv("TWILIO_WHATSAPP_FROM", "")  # Format: whatsapp:+14155238886
 TWILIO_WHATSAPP_CONTENT_SID = os.getenv("TWILIO_WHATSAPP_CONTENT_SID", "")  # Content SID für WhatsApp-Vorlage (Opt-In)
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", "4"))  # parallele WhatsApp-Sends im Hintergrund
+WHATSAPP_MAX_ATTEMPTS = int(os.getenv("WHATSAPP_MAX_ATTEMPTS", "5"))  # Versuche pro Nachricht (Backoff 1s, 2s, 4s, ...)
 APP_VERSION = os.getenv("APP_VERSION", "v6.3")
 APP_BUILD_DATE = os.getenv("APP_BUILD_DATE", dt.date.today().strftime("%Y-%m-%d"))
 VAPID_PUBLIC_KEY = os.getenv("VAPID_PUBLIC_KEY", "")
 VAPID_PRIVATE_KEY = os.getenv("VAPID_PRIVATE_KEY", "")
 VAPID_EMAIL = os.getenv("VAPID_EMAIL", "mailto:admin@example.com")
+# Diagnose-Ausgabe für die Romantik-Buchung (nur bei Bedarf aktivieren)
+_ROMANTIK_DEBUG = bool(os.getenv("SMOOBU_DEBUG_ROMANTIK"))
 
 log = logging.getLogger("smoobu")
 logging.basicConfig(level=logging.INFO)
 
-app = FastAPI(title="Smoobu Staff Planner Pro (v6.3)")
+app = FastAPI(title="Smoobu Staff Planner Pro (v6.3)", default_response_class=ORJSONResponse)
 
 if os.path.isdir("static"):
     app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -296,9 +309,14 @@ templates.env.globals.update({
     "dt": dt,
 })
 
+_WD_MAP = {"mo":0,"tu":1,"we":2,"th":3,"fr":4,"sa":5,"su":6}
+_WD_SHORT = ("Mo", "Di", "Mi", "Do", "Fr", "Sa", "So")
+_WD_LONG = ("Montag", "Dienstag", "Mittwoch", "Donnerstag", "Freitag", "Samstag", "Sonntag")
+
+@lru_cache(maxsize=4096)
 def _parse_iso_date(s: str):
     try:
-        return dt.datetime.strptime(s, "%Y-%m-%d").date()
+        return dt.date.fromisoformat(s)
     except Exception:
         return None
 
@@ -310,32 +328,52 @@ def date_wd_de(s: str, style: str = "short") -> str:
     d = _parse_iso_date(s)
     if not d:
         return s or ""
-    wd_short = ["Mo", "Di", "Mi", "Do", "Fr", "Sa", "So"]
-    wd_long  = ["Montag", "Dienstag", "Mittwoch", "Donnerstag", "Freitag", "Samstag", "Sonntag"]
-    name = wd_long[d.weekday()] if style == "long" else wd_short[d.weekday()]
+    name = (_WD_LONG if style == "long" else _WD_SHORT)[d.weekday()]
     return f"{name}, {d.strftime('%d.%m.%Y')}"
+
+# Gecacht: dieselben Datums-Strings (Serienstart/-ende, Listenansichten) werden ständig neu geparst
+@lru_cache(maxsize=4096)
 def _parse_date(s: str) -> _date | None:
     try:
-        return _dt.strptime(s, "%Y-%m-%d").date()
+        return _date.fromisoformat(s)
     except Exception:
         return None
 
+@lru_cache(maxsize=4096)
+def _last_day_of_month(y: int, m: int) -> int:
+    return calendar.monthrange(y, m)[1]
+
 def _add_months(d: _date, months: int) -> _date:
     # simple month addition handling year wrap and end-of-month
     y = d.year + (d.month - 1 + months) // 12
     m = (d.month - 1 + months) % 12 + 1
     # clamp day to last day of target month
-    import calendar
-    last_day = calendar.monthrange(y, m)[1]
+    last_day = _last_day_of_month(y, m)
     day = min(d.day, last_day)
     return _date(y, m, day)
 
+def _add_years(d: _date, years: int) -> _date:
+    # 29.02. fällt in Nicht-Schaltjahren auf den 28.02.
+    y = d.year + years
+    return _date(y, d.month, min(d.day, _last_day_of_month(y, d.month)))
+
 def _daterange_iter(start: _date, end: _date):
     cur = start
     while cur <= end:
         yield cur
         cur = cur + _td(days=1)
 
+@lru_cache(maxsize=256)
+def _parse_weekdays(byweekday: str) -> tuple[int, ...]:
+    """'MO,we,Fr' -> (0, 2, 4): sortiert, dedupliziert; () wenn nichts Gültiges dabei ist"""
+    # Wochentage als Bitmaske sammeln (dedupliziert), daraus die sortierten Tages-Offsets
+    wmask = 0
+    for p in byweekday.split(","):
+        w = _WD_MAP.get(p.strip().lower()[:2])
+        if w is not None:
+            wmask |= 1 << w
+    return tuple(w for w in range(7) if wmask & (1 << w))
+
 def _expand_series_occurrences(series: TaskSeries, start_from: _date, until: _date) -> list[_date]:
     """Return list of dates to generate between start_from and until inclusive."""
     out: list[_date] = []
@@ -351,25 +389,26 @@ def _expand_series_occurrences(series: TaskSeries, start_from: _date, until: _da
     freq = (series.frequency or "").lower()
     interval = max(1, int(series.interval or 1))
     if freq == "weekly":
-        # determine weekdays
-        wd_map = {"mo":0,"tu":1,"we":2,"th":3,"fr":4,"sa":5,"su":6}
-        if series.byweekday:
-            wds = [wd_map.get(p.strip().lower()[:2]) for p in series.byweekday.split(",")]
-            wds = [w for w in wds if w is not None]
-            if not wds:
-                wds = [s0.weekday()]
-        else:
-            wds = [s0.weekday()]
-        # find the first week start aligned to interval
-        # compute week index since start
+        # determine weekdays (parsed once per distinct byweekday string)
+        wds = _parse_weekdays(series.byweekday or "") or (s0.weekday(),)
+        # jump directly from one aligned week to the next (every `interval` weeks since start)
+        # instead of walking every day of the horizon
         start_week_monday = s0 - _td(days=s0.weekday())
-        for d in _daterange_iter(max(start_from, s0), hard_until):
-            # check interval weeks from start
-            windex = ((d - start_week_monday).days // 7)
-            if windex % interval == 0 and d.weekday() in wds and d >= s0:
+        first = max(start_from, s0)
+        windex = ((first - start_week_monday).days // 7) // interval * interval
+        week = start_week_monday + _td(weeks=windex)
+        step = _td(weeks=interval)
+        while week <= hard_until:
+            for wd in wds:
+                d = week + _td(days=wd)
+                if d < first:
+                    continue
+                if d > hard_until:
+                    break
                 out.append(d)
                 if series.count and len(out) >= series.count:
-                    break
+                    return out
+            week += step
     elif freq == "monthly":
         # bymonthday list or default to start day
         if series.bymonthday:
@@ -390,32 +429,30 @@ def _expand_series_occurrences(series: TaskSeries, start_from: _date, until: _da
         # set cur to first month that reaches start_from
         while cur < start_from:
             cur = _add_months(cur, interval)
-        gen = 0
         while cur <= hard_until:
-            import calendar
-            last_day = calendar.monthrange(cur.year, cur.month)[1]
+            last_day = _last_day_of_month(cur.year, cur.month)
             for md in mdays:
                 day = min(md, last_day)
                 d = _date(cur.year, cur.month, day)
                 if d < s0 or d < start_from or d > hard_until:
                     continue
                 out.append(d)
-                gen += 1
-                if series.count and gen >= series.count:
+                if series.count and len(out) >= series.count:
                     return out
             cur = _add_months(cur, interval)
     elif freq == "yearly":
-        cur = s0
-        while cur < start_from:
-            cur = _date(cur.year + interval, cur.month, cur.day)
-        gen = 0
+        # direkt zum ersten Termin ab start_from springen (immer von s0 aus gerechnet)
+        n = max(0, -(-(start_from.year - s0.year) // interval))
+        cur = _add_years(s0, n * interval)
+        if cur < start_from:
+            n += 1
+            cur = _add_years(s0, n * interval)
         while cur <= hard_until:
-            if cur >= s0 and cur >= start_from:
-                out.append(cur)
-                gen += 1
-                if series.count and gen >= series.count:
-                    return out
-            cur = _date(cur.year + interval, cur.month, cur.day)
+            out.append(cur)
+            if series.count and len(out) >= series.count:
+                return out
+            n += 1
+            cur = _add_years(s0, n * interval)
     else:
         # unsupported; fallback: single occurrence at start_date if in window
         if s0 >= start_from and s0 <= hard_until:
@@ -427,34 +464,54 @@ def expand_series_job(days_ahead: int = 30):
     with SessionLocal() as db:
         horizon = _date.today() + _td(days=days_ahead)
         series_list = db.query(TaskSeries).filter(TaskSeries.active==True).all()
-        created = 0
-        new_tasks: list[Task] = []
+        new_rows: list[dict] = []
+        series_ids = [ser.id for ser in series_list]
+        # last generated date per series in one query
+        last_dates = dict(
+            db.query(Task.series_id, func.max(Task.date))
+            .filter(Task.series_id.in_(series_ids))
+            .group_by(Task.series_id)
+            .all()
+        )
+        planned = []
         for ser in series_list:
-            # find last generated date for this series
-            last = db.query(Task).filter(Task.series_id==ser.id).order_by(Task.date.desc()).first()
-            start_from = _parse_date(last.date) + _td(days=1) if last else _parse_date(ser.start_date) or _date.today()
-            occ = _expand_series_occurrences(ser, start_from, horizon)
-            for d in occ:
+            last_date = last_dates.get(ser.id)
+            start_from = _parse_date(last_date) + _td(days=1) if last_date else _parse_date(ser.start_date) or _date.today()
+            occ = [d.isoformat() for d in _expand_series_occurrences(ser, start_from, horizon)]
+            if occ:
+                planned.append((ser, occ))
+        # existing (series, date) pairs, only within the window of the new occurrences
+        existing = set()
+        if planned:
+            first_iso = min(min(occ) for _, occ in planned)
+            existing = set(
+                db.query(Task.series_id, Task.date)
+                .filter(Task.series_id.in_([ser.id for ser, _ in planned]), Task.date >= first_iso)
+                .all()
+            )
+        for ser, occ in planned:
+            # Serienwerte einmal pro Serie, pro Termin nur noch das Datum
+            base = dict(
+                apartment_id=ser.apartment_id,
+                planned_minutes=ser.planned_minutes or 60,
+                notes=(ser.description or None),
+                assigned_staff_id=ser.staff_id,
+                assignment_status="pending" if ser.staff_id else None,
+                status="open",
+                auto_generated=False,
+                series_id=ser.id,
+                is_recurring=True
+            )
+            for d_iso in occ:
                 # skip if task exists for same series+date
-                exists = db.query(Task).filter(Task.series_id==ser.id, Task.date==(d.isoformat())).first()
-                if exists:
+                if (ser.id, d_iso) in existing:
                     continue
-                t = Task(
-                    date=d.isoformat(),
-                    apartment_id=ser.apartment_id,
-                    planned_minutes=ser.planned_minutes or 60,
-                    notes=(ser.description or None),
-                    assigned_staff_id=ser.staff_id,
-                    assignment_status="pending" if ser.staff_id else None,
-                    status="open",
-                    auto_generated=False,
-                    series_id=ser.id,
-                    is_recurring=True
-                )
-                db.add(t)
-                created += 1
-                new_tasks.append(t)
-        db.commit()
+                new_rows.append({"date": d_iso, **base})
+        created = len(new_rows)
+        # Bulk-Insert (executemany) ohne ORM-Objekte, in Blöcken von 1000 Zeilen
+        for i in range(0, created, 1000):
+            db.execute(insert(Task), new_rows[i:i + 1000])
+            db.commit()
         # Sofort benachrichtigen, wenn neue Zuweisungen entstanden sind
         if created > 0:
             try:
@@ -476,12 +533,35 @@ templates.env.filters["date_de"] = date_de
 templates.env.filters["date_wd_de"] = date_wd_de
 templates.env.filters["minutes_to_hhmm"] = minutes_to_hhmm
 
-def _send_email(to_email: str, subject: str, body_text: str, body_html: str | None = None):
-    if not (SMTP_HOST and SMTP_FROM):
+def _smtp_login(s: smtplib.SMTP):
+    s.starttls()
+    if SMTP_USER:
+        s.login(SMTP_USER, SMTP_PASSWORD)
+
+@contextmanager
+def _open_smtp():
+    """Eine SMTP-Verbindung für alle Mails eines Jobs (None, wenn nicht konfiguriert oder nicht erreichbar)"""
+    smtp = None
+    if SMTP_ENABLED:
+        try:
+            smtp = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=15)
+            _smtp_login(smtp)
+        except Exception as e:
+            log.error("SMTP connect failed, falling back to one connection per email: %s", e)
+            smtp = None
+    try:
+        yield smtp
+    finally:
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except Exception:
+                pass
+
+def _send_email(to_email: str, subject: str, body_text: str, body_html: str | None = None, smtp: smtplib.SMTP | None = None):
+    if not SMTP_ENABLED:
         log.warning("SMTP not configured, skipping email to %s", to_email)
         return
-    import smtplib
-    from email.message import EmailMessage
     msg = EmailMessage()
     msg["From"] = SMTP_FROM
     msg["To"] = to_email
@@ -490,34 +570,67 @@ def _send_email(to_email: str, subject: str, body_text: str, body_html: str | No
     if body_html:
         msg.add_alternative(body_html, subtype="html")
     try:
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=15) as s:
-            s.starttls()
-            if SMTP_USER:
-                s.login(SMTP_USER, SMTP_PASSWORD)
-            s.send_message(msg)
+        if smtp is not None:
+            try:
+                smtp.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                # Server hat die gemeinsame Verbindung geschlossen: neu aufbauen und erneut senden
+                smtp.connect(SMTP_HOST, SMTP_PORT)
+                smtp.ehlo()
+                _smtp_login(smtp)
+                smtp.send_message(msg)
+        else:
+            with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=15) as s:
+                _smtp_login(s)
+                s.send_message(msg)
         log.info("📧 Sent email to %s", to_email)
     except Exception as e:
         log.error("Email send failed to %s: %s", to_email, e)
 
-def _send_whatsapp(to_phone: str, message: str, use_template: bool = False):
+@lru_cache(maxsize=1)
+def _twilio_client():
+    """Ein Twilio-Client für alle Sends, damit dessen HTTP-Session (Keep-Alive) wiederverwendet wird"""
+    if _TwilioClient is None:
+        raise ImportError("twilio is not installed")
+    http_client = _TwilioHttpClient(pool_connections=True)
+    # so viele Keep-Alive-Verbindungen wie parallele Notify-Worker
+    http_client.session.mount("https://", HTTPAdapter(pool_maxsize=NOTIFY_WORKERS))
+    return _TwilioClient(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, http_client=http_client)
+
+# Ergebnis eines WhatsApp-Versands: gesendet, endgültig fehlgeschlagen oder sicher wiederholbar
+WA_SENT, WA_FAILED, WA_RETRY = "sent", "failed", "retry"
+
+def _whatsapp_error_retryable(e: Exception) -> bool:
+    """Nur Fehler, bei denen Twilio die Nachricht sicher nicht angenommen hat (POSTs sind nicht idempotent)"""
+    if TwilioRestException is not None and isinstance(e, TwilioRestException):
+        return e.status == 429 or e.status >= 500
+    if isinstance(e, _RequestsConnectionError):
+        # Verbindungsaufbau gescheitert (refused, DNS, Connect-Timeout) -> Request wurde nie gesendet;
+        # Read-Timeouts/abgebrochene Verbindungen nach dem Senden bleiben endgültig (sonst Duplikate)
+        reason = getattr(e.args[0], "reason", None) if e.args else None
+        return isinstance(reason, ConnectTimeoutError)
+    return False
+
+def _send_whatsapp(to_phone: str, message: str, use_template: bool = False) -> str:
     """Sende WhatsApp-Nachricht über Twilio
     
     Args:
         to_phone: Telefonnummer
         message: Nachrichtentext
         use_template: Wenn True, verwende Content SID (Opt-In-Vorlage), sonst freie Nachricht
+
+    Returns:
+        WA_SENT, WA_FAILED (Konfiguration, Nummer, 4xx, Status failed, unklare Fehler) oder WA_RETRY
     """
     if not (TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN and TWILIO_WHATSAPP_FROM):
         log.warning("Twilio not configured, skipping WhatsApp to %s", to_phone)
-        return False
+        return WA_FAILED
     
     if not to_phone or not to_phone.strip():
         log.warning("No phone number provided for WhatsApp")
-        return False
+        return WA_FAILED
     
     try:
-        from twilio.rest import Client
-        
         # Normalisiere Telefonnummer (entferne Leerzeichen, füge + hinzu falls nötig)
         phone = to_phone.strip().replace(" ", "").replace("-", "")
         if not phone.startswith("+"):
@@ -528,14 +641,14 @@ def _send_whatsapp(to_phone: str, message: str, use_template: bool = False):
                 phone = "+49" + phone  # 171... -> +49171...
         whatsapp_to = f"whatsapp:{phone}"
         
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+        client = _twilio_client()
         log.info("📱 Sending WhatsApp: from=%s, to=%s, message_length=%d, use_template=%s", 
                  TWILIO_WHATSAPP_FROM, whatsapp_to, len(message), use_template)
         
         # Status-Callback-URL für Delivery-Updates
         status_callback_url = None
         if BASE_URL:
-            status_callback_url = f"{BASE_URL.rstrip('/')}/webhook/twilio/status"
+            status_callback_url = f"{PUBLIC_BASE_URL}/webhook/twilio/status"
         
         # Verwende WhatsApp-Vorlage (Content SID) wenn gewünscht und konfiguriert
         if use_template and TWILIO_WHATSAPP_CONTENT_SID:
@@ -543,7 +656,7 @@ def _send_whatsapp(to_phone: str, message: str, use_template: bool = False):
             # Die Nachricht wird als Variable übergeben (normalerweise {{1}} in der Vorlage)
             message_obj = client.messages.create(
                 content_sid=TWILIO_WHATSAPP_CONTENT_SID,
-                content_variables=json.dumps({"1": message}),  # Variable 1 enthält die Nachricht
+                content_variables=orjson.dumps({"1": message}).decode(),  # Variable 1 enthält die Nachricht
                 from_=TWILIO_WHATSAPP_FROM,
                 to=whatsapp_to,
                 status_callback=status_callback_url
@@ -566,34 +679,34 @@ def _send_whatsapp(to_phone: str, message: str, use_template: bool = False):
         
         if status in ['queued', 'sent', 'delivered']:
             log.info("✅ WhatsApp sent successfully to %s (Status: %s)", phone, status)
-            return True
+            return WA_SENT
         elif status == 'failed':
             log.error("❌ WhatsApp failed to %s: %s (Code: %s)", phone, error_message, error_code)
-            return False
+            return WA_FAILED
         else:
             log.warning("⚠️ WhatsApp status unclear for %s: %s", phone, status)
-            return True  # Return True anyway, as message was accepted by Twilio
+            return WA_SENT  # von Twilio angenommen
     except ImportError:
         log.error("Twilio library not installed. Install with: pip install twilio")
-        return False
+        return WA_FAILED
     except Exception as e:
         log.error("WhatsApp send failed to %s: %s", to_phone, e, exc_info=True)
-        return False
+        return WA_RETRY if _whatsapp_error_retryable(e) else WA_FAILED
 
-def _send_whatsapp_with_opt_in(to_phone: str, message: str, staff_id: Optional[int] = None, db=None):
+def _send_whatsapp_with_opt_in(to_phone: str, message: str, staff_id: Optional[int] = None, db=None) -> str:
     """Sende WhatsApp-Nachricht mit Opt-In-Check
     
     Wenn Opt-In noch nicht bestätigt wurde, wird nur die Opt-In-Vorlage gesendet.
     Die normale Nachricht wird erst gesendet, wenn Opt-In bestätigt wurde.
+    Rückgabe wie _send_whatsapp; Warten auf Opt-In ist WA_FAILED (nicht wiederholen).
     """
     # Prüfe Opt-In-Status
     opt_in_sent = False
     opt_in_confirmed = False
-    if staff_id and db:
-        staff = db.get(Staff, staff_id)
-        if staff:
-            opt_in_sent = getattr(staff, 'whatsapp_opt_in_sent', False)
-            opt_in_confirmed = getattr(staff, 'whatsapp_opt_in_confirmed', False)
+    staff = db.get(Staff, staff_id) if staff_id and db else None
+    if staff:
+        opt_in_sent = bool(staff.whatsapp_opt_in_sent)
+        opt_in_confirmed = bool(staff.whatsapp_opt_in_confirmed)
     
     # Wenn Opt-In noch nicht bestätigt wurde
     if not opt_in_confirmed:
@@ -602,236 +715,336 @@ def _send_whatsapp_with_opt_in(to_phone: str, message: str, staff_id: Optional[i
             log.info("📱 Sending Opt-In message to %s (waiting for confirmation)", to_phone)
             opt_in_message = "Willkommen! Du erhältst ab jetzt Benachrichtigungen über neue Aufgaben."  # Kann angepasst werden
             opt_in_result = _send_whatsapp(to_phone, opt_in_message, use_template=True)
-            if opt_in_result and staff_id and db:
-                # Markiere Opt-In als gesendet (aber noch nicht bestätigt)
-                staff = db.get(Staff, staff_id)
-                if staff:
-                    staff.whatsapp_opt_in_sent = True
-                    db.commit()
-                    log.info("✅ Opt-In message sent to staff %d (waiting for confirmation)", staff_id)
+            if opt_in_result == WA_SENT and staff:
+                # Markiere Opt-In als gesendet (aber noch nicht bestätigt) – am bereits geladenen Staff
+                staff.whatsapp_opt_in_sent = True
+                db.commit()
+                log.info("✅ Opt-In message sent to staff %d (waiting for confirmation)", staff_id)
             # KEINE normale Nachricht senden, da Opt-In noch nicht bestätigt wurde
-            return opt_in_result  # True wenn Opt-In-Vorlage erfolgreich gesendet wurde
+            return opt_in_result  # WA_SENT wenn Opt-In-Vorlage erfolgreich gesendet wurde
         else:
             log.info("📱 Opt-In already sent to %s, waiting for confirmation before sending normal message", to_phone)
             # KEINE normale Nachricht senden, da Opt-In noch nicht bestätigt wurde
-            return False
+            return WA_FAILED
     
     # Opt-In wurde bestätigt - sende normale Nachricht
     log.info("📱 Opt-In confirmed for %s, sending normal message", to_phone)
     return _send_whatsapp(to_phone, message, use_template=False)
 
-def build_assignment_whatsapp_message(lang: str, staff_name: str, items: list, base_url: str) -> str:
+def build_assignment_whatsapp_message(lang: str, staff_name: str, items: list) -> str:
     """Erstelle WhatsApp-Nachricht für Zuweisungen"""
     trans = get_translations(lang)
-    msg = f"*{trans.get('zuweisung', 'Zuweisung')} · {staff_name}*\n\n"
+    parts = [f"*{trans.get('zuweisung', 'Zuweisung')} · {staff_name}*\n\n"]
     for i, it in enumerate(items, 1):
-        msg += f"*{i}. {it['apt']}* - {it['date']}\n"
-        if it['guest']:
-            msg += f"👤 {it['guest']}\n"
-        msg += f"📝 {it['desc']}\n"
-        msg += f"✅ {it['accept']}\n"
-        msg += f"❌ {it['reject']}\n\n"
-    return msg
-
-def build_assignment_email(lang: str, staff_name: str, items: list, base_url: str) -> tuple[str, str, str]:
-    trans = get_translations(lang)
-    subject = f"{trans.get('zuweisung','Zuweisung')}: {len(items)} {trans.get('tasks','Tasks')}"
-    # Text-Version
-    tlines = [f"{trans.get('team','Team')}: {staff_name}", ""]
-    for it in items:
-        tlines.append(f"- {it['date']}: {it['desc']} ({it['apt']})")
-        if it.get('guest'):
-            tlines.append(f"  {it['guest']}")
-        tlines.append(f"  {trans.get('annehmen','Annehmen')}: {it['accept']}")
-        tlines.append(f"  {trans.get('ablehnen','Ablehnen')}: {it['reject']}")
-        tlines.append("")
-    body_text = "\n".join(tlines).strip()
-    # HTML-Version (Inline-Styles für breite Kompatibilität)
-    cards = []
-    for it in items:
-        guest_html = f"<div style='color:#6c757d;font-size:13px;margin-top:4px;'>{it['guest']}</div>" if it.get('guest') else ""
-        cards.append(f"""
+        parts.append(f"*{i}. {it.apt}* - {it.date}\n")
+        if it.guest:
+            parts.append(f"👤 {it.guest}\n")
+        parts.append(f"📝 {it.desc}\n✅ {it.accept}\n❌ {it.reject}\n\n")
+    return "".join(parts)
+
+# E-Mail-HTML einmalig beim Import kompilieren; autoescape, da Notizen/Namen frei eingegeben werden
+_ASSIGNMENT_EMAIL_TMPL = Template("""
+    <div style='font-family:system-ui,-apple-system,Segoe UI,Roboto,Helvetica,Arial,sans-serif;background:#f8f9fa;padding:16px;'>
+      <div style='max-width:680px;margin:0 auto;'>
+        <h2 style='margin:0 0 12px 0;font-size:20px;'>{{ zuweisung }} · {{ staff_name }}</h2>
+        {% for it in items %}
         <div style='border:1px solid #dee2e6;border-radius:8px;padding:12px;margin:10px 0;background:#ffffff;'>
           <div style='display:flex;justify-content:space-between;align-items:center;'>
-            <div style='font-weight:700;font-size:16px'>{it['date']} · {it['apt']}</div>
-            <span style='background:#0d6efd;color:#fff;border-radius:12px;padding:4px 8px;font-size:12px;'>{trans.get('zuweisung','Zuweisung')}</span>
+            <div style='font-weight:700;font-size:16px'>{{ it.date }} · {{ it.apt }}</div>
+            <span style='background:#0d6efd;color:#fff;border-radius:12px;padding:4px 8px;font-size:12px;'>{{ zuweisung }}</span>
           </div>
-          <div style='margin-top:6px;font-size:14px;'>{it['desc']}</div>
-          {guest_html}
+          <div style='margin-top:6px;font-size:14px;'>{{ it.desc }}</div>
+          {% if it.guest %}<div style='color:#6c757d;font-size:13px;margin-top:4px;'>{{ it.guest }}</div>{% endif %}
           <div style='display:flex;gap:8px;margin-top:12px;'>
-            <a href='{it['accept']}' style='text-decoration:none;background:#198754;color:#fff;padding:8px 10px;border-radius:6px;font-weight:600;'>{trans.get('annehmen','Annehmen')}</a>
-            <a href='{it['reject']}' style='text-decoration:none;background:#dc3545;color:#fff;padding:8px 10px;border-radius:6px;font-weight:600;'>{trans.get('ablehnen','Ablehnen')}</a>
+            <a href='{{ it.accept }}' style='text-decoration:none;background:#198754;color:#fff;padding:8px 10px;border-radius:6px;font-weight:600;'>{{ annehmen }}</a>
+            <a href='{{ it.reject }}' style='text-decoration:none;background:#dc3545;color:#fff;padding:8px 10px;border-radius:6px;font-weight:600;'>{{ ablehnen }}</a>
           </div>
         </div>
-        """)
-    body_html = f"""
+        {% endfor %}
+        <div style='color:#6c757d;font-size:12px;margin-top:12px;'>
+          {{ hinweis }}: Diese E-Mail fasst Aufgaben der letzten 30 Minuten zusammen.
+        </div>
+      </div>
+    </div>
+    """, trim_blocks=True, lstrip_blocks=True, autoescape=True)
+
+_CANCELLATION_EMAIL_TMPL = Template("""
     <div style='font-family:system-ui,-apple-system,Segoe UI,Roboto,Helvetica,Arial,sans-serif;background:#f8f9fa;padding:16px;'>
       <div style='max-width:680px;margin:0 auto;'>
-        <h2 style='margin:0 0 12px 0;font-size:20px;'>{trans.get('zuweisung','Zuweisung')} · {staff_name}</h2>
-        {''.join(cards)}
-        <div style='color:#6c757d;font-size:12px;margin-top:12px;'>
-          {trans.get('hinweis','Hinweis') if 'hinweis' in trans else 'Hinweis'}: Diese E-Mail fasst Aufgaben der letzten 30 Minuten zusammen.
+        <h2 style='margin:0 0 12px 0;font-size:20px;'>Storno: Aufgaben entfallen</h2>
+        {% for it in items %}
+        <div style='border:1px solid #f1b0b7;border-radius:8px;padding:12px;margin:10px 0;background:#fff5f5;'>
+          <div style='display:flex;justify-content:space-between;align-items:center;'>
+            <div style='font-weight:700;font-size:16px'>{{ it.date }} · {{ it.apt }}</div>
+            <span style='background:#dc3545;color:#fff;border-radius:12px;padding:4px 8px;font-size:12px;'>Storniert</span>
+          </div>
+          <div style='margin-top:6px;font-size:14px;'>{{ it.desc }}</div>
+        </div>
+        {% endfor %}
+        <div style='margin-top:12px;'>
+          <a href='{{ link }}' style='text-decoration:none;background:#0d6efd;color:#fff;padding:8px 10px;border-radius:6px;font-weight:600;'>Zur Übersicht</a>
         </div>
       </div>
     </div>
-    """
+    """, trim_blocks=True, lstrip_blocks=True, autoescape=True)
+
+def build_assignment_email(lang: str, staff_name: str, items: list, base_url: str) -> tuple[str, str, str]:
+    trans = get_translations(lang)
+    subject = f"{trans.get('zuweisung','Zuweisung')}: {len(items)} {trans.get('tasks','Tasks')}"
+    # Text-Version
+    tlines = [f"{trans.get('team','Team')}: {staff_name}", ""]
+    for it in items:
+        tlines.append(f"- {it.date}: {it.desc} ({it.apt})")
+        if it.guest:
+            tlines.append(f"  {it.guest}")
+        tlines.append(f"  {trans.get('annehmen','Annehmen')}: {it.accept}")
+        tlines.append(f"  {trans.get('ablehnen','Ablehnen')}: {it.reject}")
+        tlines.append("")
+    body_text = "\n".join(tlines).strip()
+    # HTML-Version (Inline-Styles für breite Kompatibilität)
+    body_html = _ASSIGNMENT_EMAIL_TMPL.render(
+        items=items,
+        staff_name=staff_name,
+        zuweisung=trans.get('zuweisung','Zuweisung'),
+        annehmen=trans.get('annehmen','Annehmen'),
+        ablehnen=trans.get('ablehnen','Ablehnen'),
+        hinweis=trans.get('hinweis','Hinweis'),
+    )
     return subject, body_text, body_html
 
+def _has_value(col):
+    # SQL-Gegenstück zu (x or "").strip()
+    return func.trim(func.coalesce(col, "")) != ""
+
+# Nur die Spalten, die für Zuweisungs-Nachrichten gebraucht werden (kein extras_json/next_arrival_*)
+_ASSIGNMENT_TASK_COLS = load_only(Task.id, Task.date, Task.notes, Task.apartment_id, Task.booking_id, Task.assigned_staff_id)
+
+def _load_assignment_maps(db, pending: list, *staff_criteria) -> tuple[dict, dict, dict]:
+    """Staff/Apartments/Bookings der pending Tasks gesammelt laden statt db.get() pro Task
+
+    staff_criteria filtern Staff schon in SQL (z. B. ohne E-Mail); deren Tasks laden keine Apartments/Bookings.
+    """
+    staff_ids = {t.assigned_staff_id for t in pending}
+    staff_map = {s.id: s for s in db.query(Staff).filter(Staff.id.in_(staff_ids), *staff_criteria)}
+    pending = [t for t in pending if t.assigned_staff_id in staff_map]
+    apt_ids = {t.apartment_id for t in pending if t.apartment_id}
+    booking_ids = {t.booking_id for t in pending if t.booking_id}
+    apt_map = {a.id: a for a in db.query(Apartment).filter(Apartment.id.in_(apt_ids))} if apt_ids else {}
+    booking_map = {b.id: b for b in db.query(Booking).filter(Booking.id.in_(booking_ids))} if booking_ids else {}
+    return staff_map, apt_map, booking_map
+
+@dataclass(slots=True, frozen=True)
+class AssignmentItem:
+    """Ein Eintrag der Zuweisungs-Nachricht (E-Mail, WhatsApp, Report)"""
+    date: str
+    apt: str
+    desc: str
+    guest: str
+    accept: str
+    reject: str
+
+def _build_staff_items(tasks_for_staff: list, trans: Dict[str, str], token: str, base_url: str,
+                       apt_map: dict, booking_map: dict) -> list[AssignmentItem]:
+    """Einträge (Datum, Apartment, Gast, Links) für die Zuweisungs-Nachricht eines Staff"""
+    accept_prefix = f"{base_url}/c/{token}/accept?task_id="
+    reject_prefix = f"{base_url}/c/{token}/reject?task_id="
+    # Übersetzte Beschriftungen einmal pro Staff statt pro Task nachschlagen
+    default_desc = trans.get('tätigkeit','Tätigkeit')
+    adults_label = trans.get('erw','Erw.')
+    children_label = trans.get('kinder','Kinder')
+    items = []
+    for t in tasks_for_staff:
+        apt_name = ""
+        if t.apartment_id:
+            apt = apt_map.get(t.apartment_id)
+            apt_name = apt.name if apt else ""
+        guest_str = ""
+        if t.booking_id:
+            b = booking_map.get(t.booking_id)
+            if b:
+                gname = (b.guest_name or "").strip()
+                if gname:
+                    guest_str = f"{gname}"
+                else:
+                    # Adults/children fallback
+                    ac = []
+                    if b.adults:
+                        ac.append(f"{adults_label} {b.adults}")
+                    if b.children:
+                        ac.append(f"{children_label} {b.children}")
+                    guest_str = ", ".join(ac)
+        desc = (t.notes or "").strip() or default_desc
+        items.append(AssignmentItem(
+            t.date, apt_name, desc, guest_str,
+            accept_prefix + str(t.id),
+            reject_prefix + str(t.id),
+        ))
+    return items
+
+# Benachrichtigungen (WhatsApp, WebPush) laufen im Hintergrund, damit Jobs/Requests nicht auf Provider warten
+_notify_pool = ThreadPoolExecutor(max_workers=NOTIFY_WORKERS, thread_name_prefix="notify")
+
+def _whatsapp_waiting_for_opt_in(staff: Staff) -> bool:
+    """True, wenn _send_whatsapp_with_opt_in für diesen Staff ohnehin nichts senden würde"""
+    if staff.whatsapp_opt_in_confirmed:
+        return False
+    return bool(staff.whatsapp_opt_in_sent) or not TWILIO_WHATSAPP_CONTENT_SID
+
+def _submit_later(delay: float, fn, *args):
+    def _submit():
+        try:
+            _notify_pool.submit(fn, *args)
+        except RuntimeError:
+            log.warning("Notify pool shut down, dropping retry of %s", fn.__name__)
+    timer = threading.Timer(delay, _submit)
+    timer.daemon = True
+    timer.start()
+
+def _dispatch_assignment_whatsapp(staff_id: int, phone: str, lang: str, items: list, existing: bool = False, attempt: int = 0):
+    # eigene Session pro Worker (Opt-In-Status wird dort gelesen/gespeichert)
+    with SessionLocal() as db:
+        staff = db.get(Staff, staff_id)
+        if not staff:
+            return
+        # Nur sicher wiederholbare Fehler erneut versuchen (Konfiguration/4xx/unklare Timeouts nicht: Duplikate)
+        if _send_assignment_whatsapp(db, staff, phone, lang, items, existing) != WA_RETRY:
+            return
+        name = staff.name
+    # Vorübergehender Fehler: später erneut versuchen statt den Worker mit Warten zu blockieren
+    attempt += 1
+    if attempt >= WHATSAPP_MAX_ATTEMPTS:
+        log.error("❌ WhatsApp to %s (staff: %s) given up after %d attempts", phone, name, attempt)
+        return
+    delay = 2 ** (attempt - 1)
+    log.info("🔁 WhatsApp to %s (staff: %s) retry %d in %ds", phone, name, attempt, delay)
+    _submit_later(delay, _dispatch_assignment_whatsapp, staff_id, phone, lang, items, existing, attempt)
+
+def _send_assignment_whatsapp(db, staff: Staff, phone: str, lang: str, items: list, existing: bool = False) -> str:
+    # Erfolge nur auf DEBUG (Batch-Zusammenfassung in _submit_whatsapp_batch), Fehler weiterhin einzeln
+    try:
+        log.debug("📱 Sending WhatsApp to %s for staff %s (%d %stasks)", phone, staff.name, len(items), "existing " if existing else "")
+        whatsapp_msg = build_assignment_whatsapp_message(lang, staff.name, items)
+        if staff.whatsapp_opt_in_confirmed:
+            # Fast path: Opt-In bestätigt -> direkt senden, ohne erneuten Staff-Lookup/Opt-In-Prüfung
+            result = _send_whatsapp(phone, whatsapp_msg)
+        else:
+            result = _send_whatsapp_with_opt_in(phone, whatsapp_msg, staff_id=staff.id, db=db)
+        if result == WA_SENT:
+            log.debug("✅ WhatsApp queued/sent to %s (staff: %s) - Delivery status will be logged via webhook", phone, staff.name)
+        else:
+            log.warning("❌ WhatsApp send failed to %s (staff: %s) - check logs above for details", phone, staff.name)
+        return result
+    except Exception as e:
+        log.error("WhatsApp notification error for staff %s: %s", staff.name, e, exc_info=True)
+        return WA_FAILED  # unklar, ob schon gesendet -> nicht wiederholen
+
+def _submit_whatsapp_batch(jobs: list[tuple], existing: bool = False):
+    """jobs: (staff_id, phone, lang, items) je Staff"""
+    if jobs:
+        log.info("📱 WhatsApp batch: %d %smessages queued", len(jobs), "existing-assignment " if existing else "")
+    dropped = []
+    for args in jobs:
+        try:
+            _notify_pool.submit(_dispatch_assignment_whatsapp, *args, existing)
+        except RuntimeError:
+            # Pool nach Shutdown geschlossen; Tasks sind bereits als benachrichtigt markiert
+            dropped.append(args[0])
+    if dropped:
+        log.error("Notify pool shut down, WhatsApp not sent to staff %s", dropped)
+
 def send_assignment_emails_job():
-    base_url = BASE_URL.rstrip("/") or ""
+    base_url = PUBLIC_BASE_URL
     with SessionLocal() as db:
-        pending = db.query(Task).filter(Task.assignment_status=="pending", Task.assigned_staff_id!=None, Task.assign_notified_at==None).all()
+        pending = (
+            db.query(Task)
+            .options(_ASSIGNMENT_TASK_COLS)
+            .filter(Task.assignment_status=="pending", Task.assigned_staff_id!=None, Task.assign_notified_at==None)
+            .order_by(Task.assigned_staff_id)
+            .all()
+        )
         if not pending:
             return []
-        staff_ids = {t.assigned_staff_id for t in pending if t.assigned_staff_id}
+        staff_map, apt_map, booking_map = _load_assignment_maps(db, pending, _has_value(Staff.email))
         report = []
-        for sid in staff_ids:
-            staff = db.get(Staff, sid)
-            if not staff or not (staff.email or "").strip():
-                continue
-            lang = (staff.language or "de")
-            token = staff.magic_token
-            tasks_for_staff = [t for t in pending if t.assigned_staff_id==sid]
-            items = []
-            trans = get_translations(lang)
-            for t in tasks_for_staff:
-                apt_name = ""
-                if t.apartment_id:
-                    apt = db.get(Apartment, t.apartment_id)
-                    apt_name = apt.name if apt else ""
-                guest_str = ""
-                if t.booking_id:
-                    b = db.get(Booking, t.booking_id)
-                    if b:
-                        gname = (b.guest_name or "").strip()
-                        if gname:
-                            guest_str = f"{gname}"
-                        else:
-                            # Adults/children fallback
-                            ac = []
-                            if b.adults:
-                                ac.append(f"{trans.get('erw','Erw.')} {b.adults}")
-                            if b.children:
-                                ac.append(f"{trans.get('kinder','Kinder')} {b.children}")
-                            guest_str = ", ".join(ac)
-                desc = (t.notes or "").strip() or get_translations(lang).get('tätigkeit','Tätigkeit')
-                accept_link = f"{base_url}/c/{token}/accept?task_id={t.id}"
-                reject_link = f"{base_url}/c/{token}/reject?task_id={t.id}"
-                items.append({
-                    'date': t.date,
-                    'apt': apt_name,
-                    'desc': desc,
-                    'guest': guest_str,
-                    'accept': accept_link,
-                    'reject': reject_link,
-                })
-            subject, body_text, body_html = build_assignment_email(lang, staff.name, items, base_url)
-            _send_email(staff.email, subject, body_text, body_html)
+        notified_ids: list[int] = []
+        whatsapp_jobs: list[tuple] = []
+        with _open_smtp() as smtp:
+            # pending ist nach Staff sortiert -> in einem Durchlauf gruppieren
+            for sid, group in groupby(pending, key=lambda t: t.assigned_staff_id):
+                staff = staff_map.get(sid)
+                if not staff or not (staff.email or "").strip():
+                    continue
+                lang = (staff.language or "de")
+                phone = (staff.phone or "").strip()
+                tasks_for_staff = list(group)
+                items = _build_staff_items(tasks_for_staff, get_translations(lang), staff.magic_token, base_url, apt_map, booking_map)
+                if SMTP_ENABLED:
+                    subject, body_text, body_html = build_assignment_email(lang, staff.name, items, base_url)
+                    _send_email(staff.email, subject, body_text, body_html, smtp=smtp)
             
-            # WhatsApp-Benachrichtigung senden (falls Telefonnummer vorhanden)
-            try:
-                phone = getattr(staff, 'phone', None) or ""
-                if phone and phone.strip():
-                    log.info("📱 Sending WhatsApp to %s for staff %s (%d tasks)", phone, staff.name, len(items))
-                    whatsapp_msg = build_assignment_whatsapp_message(lang, staff.name, items, base_url)
-                    result = _send_whatsapp_with_opt_in(phone, whatsapp_msg, staff_id=sid, db=db)
-                    if result:
-                        log.info("✅ WhatsApp queued/sent to %s (staff: %s) - Delivery status will be logged via webhook", phone, staff.name)
-                    else:
-                        log.warning("❌ WhatsApp send failed to %s (staff: %s) - check logs above for details", phone, staff.name)
+                # WhatsApp-Benachrichtigung nach dem Commit senden (falls Telefonnummer vorhanden)
+                if phone and _whatsapp_waiting_for_opt_in(staff):
+                    log.info("📱 Opt-In already sent to %s, waiting for confirmation before sending normal message", phone)
+                elif phone:
+                    whatsapp_jobs.append((sid, phone, lang, items))
                 else:
                     log.debug("No phone number for staff %s, skipping WhatsApp", staff.name)
-            except Exception as e:
-                log.error("WhatsApp notification error for staff %s: %s", staff.name, e, exc_info=True)
             
-            now = now_iso()
-            for t in tasks_for_staff:
-                t.assign_notified_at = now
-            try:
-                phone = getattr(staff, 'phone', None) or ""
-            except:
-                phone = ""
-            report.append({
-                'staff_name': staff.name,
-                'email': staff.email,
-                'phone': phone,
-                'count': len(items),
-                'items': items,
-            })
+                notified_ids.extend(t.id for t in tasks_for_staff)
+                report.append({
+                    'staff_name': staff.name,
+                    'email': staff.email,
+                    'phone': phone,
+                    'count': len(items),
+                    'items': items,
+                })
+        # Benachrichtigt-Zeitstempel mit einem UPDATE statt pro Task-Objekt setzen
+        if notified_ids:
+            # Stempel sind idempotent -> kein fsync pro Commit nötig
+            relax_sync(db)
+            db.query(Task).filter(Task.id.in_(notified_ids), Task.assign_notified_at==None).update(
+                {Task.assign_notified_at: now_iso()}, synchronize_session=False
+            )
         db.commit()
-        return report
+    _submit_whatsapp_batch(whatsapp_jobs)
+    return report
 
 def send_whatsapp_for_existing_assignments():
     """Sende nur WhatsApp-Benachrichtigungen für bestehende Zuweisungen (auch wenn bereits per Email benachrichtigt)"""
-    base_url = BASE_URL.rstrip("/") or ""
+    base_url = PUBLIC_BASE_URL
     with SessionLocal() as db:
         # Hole alle pending Tasks mit zugewiesenem Staff (auch wenn bereits benachrichtigt)
-        pending = db.query(Task).filter(
-            Task.assignment_status=="pending", 
-            Task.assigned_staff_id!=None
-        ).all()
+        pending = (
+            db.query(Task)
+            .options(_ASSIGNMENT_TASK_COLS)
+            .filter(Task.assignment_status=="pending", Task.assigned_staff_id!=None)
+            .order_by(Task.assigned_staff_id)
+            .all()
+        )
         if not pending:
             return []
-        staff_ids = {t.assigned_staff_id for t in pending if t.assigned_staff_id}
+        staff_map, apt_map, booking_map = _load_assignment_maps(db, pending, _has_value(Staff.phone))
         report = []
-        for sid in staff_ids:
-            staff = db.get(Staff, sid)
+        whatsapp_jobs: list[tuple] = []
+        for sid, group in groupby(pending, key=lambda t: t.assigned_staff_id):
+            staff = staff_map.get(sid)
             if not staff:
                 continue
             # Prüfe ob Telefonnummer vorhanden ist
-            phone = getattr(staff, 'phone', None) or ""
-            if not phone or not phone.strip():
+            phone = (staff.phone or "").strip()
+            if not phone:
                 log.debug("No phone number for staff %s, skipping WhatsApp", staff.name)
                 continue
+            # Ohne bestätigtes Opt-In wird nichts gesendet -> Einträge/Links gar nicht erst bauen
+            if _whatsapp_waiting_for_opt_in(staff):
+                log.info("📱 Opt-In already sent to %s, waiting for confirmation before sending normal message", phone)
+                continue
             
             lang = (staff.language or "de")
-            token = staff.magic_token
-            tasks_for_staff = [t for t in pending if t.assigned_staff_id==sid]
-            items = []
-            trans = get_translations(lang)
-            for t in tasks_for_staff:
-                apt_name = ""
-                if t.apartment_id:
-                    apt = db.get(Apartment, t.apartment_id)
-                    apt_name = apt.name if apt else ""
-                guest_str = ""
-                if t.booking_id:
-                    b = db.get(Booking, t.booking_id)
-                    if b:
-                        gname = (b.guest_name or "").strip()
-                        if gname:
-                            guest_str = f"{gname}"
-                        else:
-                            # Adults/children fallback
-                            ac = []
-                            if b.adults:
-                                ac.append(f"{trans.get('erw','Erw.')} {b.adults}")
-                            if b.children:
-                                ac.append(f"{trans.get('kinder','Kinder')} {b.children}")
-                            guest_str = ", ".join(ac)
-                desc = (t.notes or "").strip() or get_translations(lang).get('tätigkeit','Tätigkeit')
-                accept_link = f"{base_url}/c/{token}/accept?task_id={t.id}"
-                reject_link = f"{base_url}/c/{token}/reject?task_id={t.id}"
-                items.append({
-                    'date': t.date,
-                    'apt': apt_name,
-                    'desc': desc,
-                    'guest': guest_str,
-                    'accept': accept_link,
-                    'reject': reject_link,
-                })
+            items = _build_staff_items(list(group), get_translations(lang), staff.magic_token, base_url, apt_map, booking_map)
             
-            # Nur WhatsApp senden (keine Email)
-            try:
-                log.info("📱 Sending WhatsApp to %s for staff %s (%d existing tasks)", phone, staff.name, len(items))
-                whatsapp_msg = build_assignment_whatsapp_message(lang, staff.name, items, base_url)
-                result = _send_whatsapp_with_opt_in(phone, whatsapp_msg, staff_id=sid, db=db)
-                if result:
-                    log.info("✅ WhatsApp queued/sent to %s (staff: %s) - Delivery status will be logged via webhook", phone, staff.name)
-                else:
-                    log.warning("❌ WhatsApp send failed to %s (staff: %s) - check logs above for details", phone, staff.name)
-            except Exception as e:
-                log.error("WhatsApp notification error for staff %s: %s", staff.name, e, exc_info=True)
+            # Nur WhatsApp senden (keine Email), im Hintergrund
+            whatsapp_jobs.append((sid, phone, lang, items))
             
             report.append({
                 'staff_name': staff.name,
@@ -839,8 +1052,8 @@ def send_whatsapp_for_existing_assignments():
                 'count': len(items),
                 'items': items,
             })
-        db.commit()
-        return report
+    _submit_whatsapp_batch(whatsapp_jobs, existing=True)
+    return report
 
 def get_db():
     db = SessionLocal()
@@ -849,149 +1062,230 @@ def get_db():
     finally:
         db.close()
 
+_WARMUP_TEMPLATES = ("admin_home.html", "admin_staff.html", "admin_apartments.html", "admin_series.html", "cleaner.html")
+
+def _warmup():
+    """Templates kompilieren und VAPID-Schlüssel parsen, bevor der erste Request kommt"""
+    for name in _WARMUP_TEMPLATES:
+        templates.get_template(name)
+    app.state.vapid_key = None
+    if VAPID_PRIVATE_KEY:
+        try:
+            app.state.vapid_key = Vapid.from_string(private_key=VAPID_PRIVATE_KEY)
+        except Exception as e:
+            log.warning("Invalid VAPID_PRIVATE_KEY, WebPush will parse it per request: %s", e)
+
 @app.on_event("startup")
 async def startup_event():
     init_db()
+    await asyncio.to_thread(_warmup)
     if not ADMIN_TOKEN:
         log.warning("ADMIN_TOKEN not set! Admin UI will be inaccessible.")
     try:
         await refresh_bookings_job()
     except Exception as e:
         log.exception("Initial import failed: %s", e)
-    scheduler = AsyncIOScheduler(timezone=TIMEZONE)
-    scheduler.add_job(refresh_bookings_job, IntervalTrigger(minutes=REFRESH_INTERVAL_MINUTES))
+    # Überfällige Läufe zusammenfassen und nie parallel ausführen
+    scheduler = AsyncIOScheduler(
+        timezone=TIMEZONE,
+        job_defaults={"coalesce": True, "max_instances": 1, "misfire_grace_time": 60},
+    )
+    scheduler.add_job(refresh_bookings_job, IntervalTrigger(minutes=REFRESH_INTERVAL_MINUTES), id="refresh_bookings", replace_existing=True)
     # Bündel-E-Mails für Zuweisungen alle 30 Minuten
-    scheduler.add_job(send_assignment_emails_job, IntervalTrigger(minutes=30))
+    scheduler.add_job(send_assignment_emails_job, IntervalTrigger(minutes=30), id="send_assignment_emails", replace_existing=True)
     # Expand recurring TaskSeries daily
-    scheduler.add_job(expand_series_job, IntervalTrigger(hours=24))
+    scheduler.add_job(expand_series_job, IntervalTrigger(hours=24), id="expand_series", replace_existing=True)
     scheduler.start()
 
+@app.on_event("shutdown")
+def shutdown_event():
+    # laufende WhatsApp-Sends noch zu Ende bringen
+    _notify_pool.shutdown(wait=True)
+
+# Abrufzeitraum: voller Abgleich beim Kaltstart und einmal täglich, sonst nur die nahe Zukunft
+FULL_SYNC_DAYS = 60
+WARM_SYNC_DAYS = 14
+FULL_SYNC_EVERY = _td(hours=24)
+
 def _daterange(days=60):
     start = dt.date.today()
     end = start + dt.timedelta(days=days)
     return start.isoformat(), end.isoformat()
 
-def _best_guest_name(it: dict) -> str:
+def _guest_name_candidates(it: dict):
+    # Häufige Felder, lazy in Prioritätsreihenfolge (meist genügt der erste Treffer)
     guest = it.get("guest") or {}
-    # Häufige Felder
-    candidates = [
-        guest.get("fullName"),
-        (f"{guest.get('firstName','')} {guest.get('lastName','')}".strip() or None),
-        (f"{it.get('firstName','')} {it.get('lastName','')}".strip() or None),
-        it.get("guestName"),
-        it.get("mainGuestName"),
-        it.get("contactName"),
-        it.get("name"),
-        (it.get("contact") or {}).get("name"),
-    ]
-    for c in candidates:
+    yield guest.get("fullName")
+    yield f"{guest.get('firstName','')} {guest.get('lastName','')}"
+    yield f"{it.get('firstName','')} {it.get('lastName','')}"
+    yield it.get("guestName")
+    yield it.get("mainGuestName")
+    yield it.get("contactName")
+    yield it.get("name")
+    yield (it.get("contact") or {}).get("name")
+
+# Skip-Regeln in Prüfreihenfolge: (Prädikat(it, status, booking_type), Grund)
+_SKIP_RULES = (
+    (lambda it, s, bt: bt == "cancellation", "cancellation type"),
+    (lambda it, s, bt: s == "cancelled" or it.get("cancelled", False), "cancelled"),
+    (lambda it, s, bt: it.get("isBlockedBooking", False) or it.get("blocked", False), "blocked"),
+    (lambda it, s, bt: it.get("isInternal", False), "internal"),
+    (lambda it, s, bt: s == "draft", "draft"),
+    (lambda it, s, bt: s == "pending", "pending"),
+    (lambda it, s, bt: s in ("on hold", "on_hold"), "on-hold"),
+)
+
+def _best_guest_name(it: dict) -> str:
+    for c in _guest_name_candidates(it):
         if c and isinstance(c, str) and c.strip():
             return c.strip()
     return ""
 
 def _guest_count_label(it: dict) -> str:
+    adults = it.get("adults")
+    children = it.get("children")
+    # Alternativ-Felder absichern
+    if adults is None:
+        adults = it.get("numAdults") or it.get("guests")
+    if children is None:
+        children = it.get("numChildren")
     try:
-        adults = it.get("adults")
-        children = it.get("children")
-        # Alternativ-Felder absichern
-        if adults is None:
-            adults = it.get("numAdults") or it.get("guests") or 0
-        if children is None:
-            children = it.get("numChildren") or 0
-        adults = int(adults or 0)
-        children = int(children or 0)
-        total = adults + children
-        if total <= 0 and (adults > 0 or children > 0):
-            total = adults + children
-        if total > 0:
-            # Einfache deutsche Bezeichnung
-            return f"{total} Gäste"
-    except Exception:
-        pass
-    return ""
+        total = int(adults or 0) + int(children or 0)
+    except (TypeError, ValueError):
+        return ""
+    # Einfache deutsche Bezeichnung
+    return f"{total} Gäste" if total > 0 else ""
 
-async def refresh_bookings_job():
+def _build_cancellation_mails(db, apt_names: dict[int, str]) -> list[tuple[str, str, str, str]]:
+    """Storno-Mails an zugewiesene Cleaner bauen, eine pro Buchung und Staff (apt_names: booking_id -> Apartment)
+
+    Liefert (to, subject, text, html); verschickt wird erst nach dem Commit, ohne offene DB-Session.
+    """
+    # Betroffene, zugewiesene (nicht abgelehnte) Tasks aller Buchungen in einer Abfrage
+    tasks = (
+        db.query(Task)
+        .filter(
+            Task.booking_id.in_(list(apt_names)),
+            Task.assigned_staff_id!=None,
+            (Task.assignment_status==None) | (Task.assignment_status!="rejected"),
+        )
+        .order_by(Task.booking_id)
+        .all()
+    )
+    if not tasks:
+        return []
+    staff_map = {s.id: s for s in db.query(Staff).filter(Staff.id.in_({t.assigned_staff_id for t in tasks}))}
+    # Übersetzungsabhängige Texte nur einmal pro Sprache bauen
+    lang_texts: Dict[str, tuple] = {}
+    mails = []
+    for b_id, btasks in groupby(tasks, key=lambda t: t.booking_id):
+        apt_name = apt_names.get(b_id) or ""
+        try:
+            by_staff: Dict[int, list] = {}
+            for t in btasks:
+                by_staff.setdefault(t.assigned_staff_id, []).append(t)
+            for sid, tlist in by_staff.items():
+                staff = staff_map.get(sid)
+                if not staff or not (staff.email or "").strip():
+                    continue
+                lang = staff.language or "de"
+                texts = lang_texts.get(lang)
+                if texts is None:
+                    trans = get_translations(lang)
+                    texts = lang_texts[lang] = (
+                        f"{trans.get('cleanup','Bereinigen')}: {trans.get('zuweisung','Zuweisung')} storniert",
+                        f"{trans.get('zuweisung','Zuweisung')} storniert:",
+                        trans.get('tätigkeit','Tätigkeit'),
+                    )
+                subject, header, default_desc = texts
+                # E-Mail-Inhalte pro Staff
+                link = f"{PUBLIC_BASE_URL}/cleaner/{staff.magic_token}"
+                # Einträge (für HTML) und Text-Zeilen in einem Durchlauf
+                items = []
+                lines = [header]
+                for t in tlist:
+                    it = {
+                        'date': t.date,
+                        'apt': apt_name,
+                        'desc': (t.notes or "").strip() or default_desc,
+                        'link': link,
+                    }
+                    items.append(it)
+                    lines.append(f"- {it['date']} · {it['apt']} · {it['desc']}")
+                lines.append("")
+                lines.append(link)
+                body_text = "\n".join(lines)
+                # HTML
+                body_html = _CANCELLATION_EMAIL_TMPL.render(items=items, link=link)
+                mails.append((staff.email, subject, body_text, body_html))
+        except Exception as e:
+            log.error("Error building cancellation notifications for booking %d: %s", b_id, e)
+    return mails
+
+def _send_cancellation_mails(mails: list[tuple[str, str, str, str]]):
+    with _open_smtp() as smtp:
+        for to_email, subject, body_text, body_html in mails:
+            _send_email(to_email, subject, body_text, body_html, smtp=smtp)
+
+def _refresh_bookings_sync(force_full: bool = False):
     client = SmoobuClient()
-    start, end = _daterange(60)
-    log.info("🔄 Starting refresh: %s to %s", start, end)
+    started = _dt.now()
+    last_full = getattr(app.state, "last_full_sync", None)
+    full = force_full or last_full is None or started - last_full >= FULL_SYNC_EVERY
+    start, end = _daterange(FULL_SYNC_DAYS if full else WARM_SYNC_DAYS)
+    log.info("🔄 Starting %s refresh: %s to %s", "full" if full else "warm", start, end)
     items = client.get_reservations(start, end)
     log.info("📥 Fetched %d bookings from Smoobu", len(items))
     with SessionLocal() as db:
-        seen_booking_ids: List[int] = []
-        seen_apartment_ids: List[int] = []
+        seen_booking_ids: set[int] = set()
+        seen_apartment_ids: set[int] = set()
+        skipped: dict[int, str] = {}  # booking_id -> apartment name
+        cancel_mails: list[tuple[str, str, str, str]] = []
+        # Vorhandene Buchungen/Apartments in je einer Abfrage laden statt db.get() pro Eintrag
+        item_ids = {int(it.get("id")) for it in items}
+        item_apt_ids = {int((it.get("apartment") or {})["id"]) for it in items if (it.get("apartment") or {}).get("id") is not None}
+        booking_map = {b.id: b for b in db.query(Booking).filter(Booking.id.in_(item_ids))} if item_ids else {}
+        apt_map = {a.id: a for a in db.query(Apartment).filter(Apartment.id.in_(item_apt_ids))} if item_apt_ids else {}
         for it in items:
             b_id = int(it.get("id"))
             apt = it.get("apartment") or {}
             apt_id = int(apt.get("id")) if apt.get("id") is not None else None
             apt_name = apt.get("name") or ""
+            # Felder einmal pro Eintrag auslesen und unten wiederverwenden
+            arrival = (it.get("arrival") or "")[:10]
+            departure = (it.get("departure") or "")[:10]
+            status = (it.get("status") or "").lower()
+            booking_type = (it.get("type") or "").lower()
             guest_name = _best_guest_name(it)
             if guest_name:
                 log.debug("📝 Guest name for booking %d: '%s'", b_id, guest_name)
             else:
-                # Breiteres Logging zur Diagnose, wenn kein Name geliefert wird
-                try:
-                    log.warning("⚠️ No guest name in booking %d. Available keys: %s", b_id, list(it.keys()))
-                    if it.get("guest"):
-                        log.warning("⚠️ guest keys: %s", list((it.get("guest") or {}).keys()))
-                    if it.get("contact"):
-                        log.warning("⚠️ contact keys: %s", list((it.get("contact") or {}).keys()))
-                    log.warning("⚠️ adults=%s children=%s guests=%s", it.get("adults"), it.get("children"), it.get("guests"))
-                except Exception:
-                    pass
+                # Breiteres Logging zur Diagnose, wenn kein Name geliefert wird (Key-Listen nur bauen, wenn geloggt wird)
+                if log.isEnabledFor(logging.WARNING):
+                    try:
+                        log.warning("⚠️ No guest name in booking %d. Available keys: %s", b_id, list(it.keys()))
+                        if it.get("guest"):
+                            log.warning("⚠️ guest keys: %s", list((it.get("guest") or {}).keys()))
+                        if it.get("contact"):
+                            log.warning("⚠️ contact keys: %s", list((it.get("contact") or {}).keys()))
+                        log.warning("⚠️ adults=%s children=%s guests=%s", it.get("adults"), it.get("children"), it.get("guests"))
+                    except Exception:
+                        pass
                 # Fallback: Gästeanzahl
                 guest_name = _guest_count_label(it) or ""
-            arrival = (it.get("arrival") or "")[:10]
-            departure = (it.get("departure") or "")[:10]
 
-            # Check if booking is cancelled or blocked
-            is_blocked = it.get("isBlockedBooking", False) or it.get("blocked", False)
-            status = it.get("status", "").lower() if it.get("status") else ""
-            cancelled = status == "cancelled" or it.get("cancelled", False)
-            is_internal = it.get("isInternal", False)
-            
-            # Check for various status
-            is_draft = status == "draft"
-            is_pending = status == "pending"
-            is_on_hold = status == "on hold" or status == "on_hold"
-            
+            # Storniert/geblockt/intern/Entwurf/... -> SKIP and DELETE (erste passende Regel liefert den Grund)
+            reason = next((r for pred, r in _SKIP_RULES if pred(it, status, booking_type)), "")
+            should_skip = bool(reason)
+
             log.debug("Smoobu booking %d: apt='%s', arrival='%s', departure='%s', status='%s'", 
                      b_id, apt_name, arrival, departure, it.get("status"))
             
-            # Log ALL fields for Romantik to debug
-            if apt_name and "romantik" in apt_name.lower() and "2025-10-29" in departure:
+            # Log ALL fields for Romantik to debug (opt-in via SMOOBU_DEBUG_ROMANTIK)
+            if _ROMANTIK_DEBUG and apt_name and "romantik" in apt_name.lower() and "2025-10-29" in departure:
                 log.warning("🎯 ROMANTIK FULL BOOKING DATA: %s", it)
-                log.warning("🎯 Status fields: type='%s', status='%s', cancelled=%s, blocked=%s, internal=%s, draft=%s, pending=%s, on_hold=%s", 
-                           it.get("type"), status, cancelled, is_blocked, is_internal, is_draft, is_pending, is_on_hold)
+                log.warning("🎯 Status fields: type='%s', status='%s', skip_reason='%s'", it.get("type"), status, reason)
 
-            # Check booking type FIRST - before we update or create the booking
-            booking_type = it.get("type", "").lower()
-            
-            # Check for cancelled, blocked, internal, draft, pending, on-hold bookings OR cancellation type - SKIP and DELETE these!
-            should_skip = False
-            reason = ""
-            
-            if booking_type == "cancellation":
-                should_skip = True
-                reason = "cancellation type"
-            elif cancelled:
-                should_skip = True
-                reason = "cancelled"
-            elif is_blocked:
-                should_skip = True
-                reason = "blocked"
-            elif is_internal:
-                should_skip = True
-                reason = "internal"
-            elif is_draft:
-                should_skip = True
-                reason = "draft"
-            elif is_pending:
-                should_skip = True
-                reason = "pending"
-            elif is_on_hold:
-                should_skip = True
-                reason = "on-hold"
-            
             # Check for invalid bookings - also skip and delete
             if not departure or not departure.strip():
                 log.info("⛔ SKIP INVALID booking %d (%s) - NO DEPARTURE, arrival='%s'", b_id, apt_name, arrival)
@@ -1008,95 +1302,30 @@ async def refresh_bookings_job():
             
             if should_skip:
                 log.info("⛔ SKIP %s booking %d (%s) - arrival: %s, departure: %s", reason, b_id, apt_name, arrival, departure)
-                # Sofort-Benachrichtigung an zugewiesene Cleaner über Storno + zugehörige Tasks löschen
-                try:
-                    # Sammle betroffene Tasks
-                    tasks = db.query(Task).filter(Task.booking_id==b_id).all()
-                    by_staff: Dict[int, list] = {}
-                    for t in tasks:
-                        if t.assigned_staff_id and t.assignment_status != "rejected":
-                            by_staff.setdefault(t.assigned_staff_id, []).append(t)
-                    for sid, tlist in by_staff.items():
-                        staff = db.get(Staff, sid)
-                        if not staff or not (staff.email or "").strip():
-                            continue
-                        lang = staff.language or "de"
-                        trans = get_translations(lang)
-                        # E-Mail-Inhalte pro Staff
-                        items = []
-                        for t in tlist:
-                            token = staff.magic_token
-                            items.append({
-                                'date': t.date,
-                                'apt': apt_name or "",
-                                'desc': (t.notes or "").strip() or trans.get('tätigkeit','Tätigkeit'),
-                                'link': f"{BASE_URL.rstrip('/')}/cleaner/{token}",
-                            })
-                        subject = f"{trans.get('cleanup','Bereinigen')}: {trans.get('zuweisung','Zuweisung')} storniert"
-                        # Text
-                        lines = [f"{trans.get('zuweisung','Zuweisung')} storniert:"]
-                        for it in items:
-                            lines.append(f"- {it['date']} · {it['apt']} · {it['desc']}")
-                        lines.append("")
-                        lines.append(items[0]['link'])
-                        body_text = "\n".join(lines)
-                        # HTML
-                        cards = []
-                        for it in items:
-                            cards.append(f"""
-                            <div style='border:1px solid #f1b0b7;border-radius:8px;padding:12px;margin:10px 0;background:#fff5f5;'>
-                              <div style='display:flex;justify-content:space-between;align-items:center;'>
-                                <div style='font-weight:700;font-size:16px'>{it['date']} · {it['apt']}</div>
-                                <span style='background:#dc3545;color:#fff;border-radius:12px;padding:4px 8px;font-size:12px;'>Storniert</span>
-                              </div>
-                              <div style='margin-top:6px;font-size:14px;'>{it['desc']}</div>
-                            </div>
-                            """)
-                        body_html = f"""
-                        <div style='font-family:system-ui,-apple-system,Segoe UI,Roboto,Helvetica,Arial,sans-serif;background:#f8f9fa;padding:16px;'>
-                          <div style='max-width:680px;margin:0 auto;'>
-                            <h2 style='margin:0 0 12px 0;font-size:20px;'>Storno: Aufgaben entfallen</h2>
-                            {''.join(cards)}
-                            <div style='margin-top:12px;'>
-                              <a href='{items[0]['link']}' style='text-decoration:none;background:#0d6efd;color:#fff;padding:8px 10px;border-radius:6px;font-weight:600;'>Zur Übersicht</a>
-                            </div>
-                          </div>
-                        </div>
-                        """
-                        _send_email(staff.email, subject, body_text, body_html)
-                except Exception as e:
-                    log.error("Error sending cancellation notifications for booking %d: %s", b_id, e)
-                # Delete existing booking if it exists
-                b_existing = db.get(Booking, b_id)
-                if b_existing:
-                    db.delete(b_existing)
-                    log.info("🗑️ Deleted existing booking %d from database", b_id)
-                # Lösche zugehörige Tasks direkt
-                for t in db.query(Task).filter(Task.booking_id==b_id).all():
-                    db.delete(t)
-                db.commit()
+                # Benachrichtigung + Löschen gesammelt nach der Schleife
+                skipped[b_id] = apt_name
                 continue
             
-            # Only log valid bookings
-            log.info("✓ Valid booking %d (%s) - arrival: %s, departure: %s", b_id, apt_name, arrival, departure)
+            # Only log valid bookings (debug: one line per booking and refresh)
+            log.debug("✓ Valid booking %d (%s) - arrival: %s, departure: %s", b_id, apt_name, arrival, departure)
             
             if apt_id is not None and apt_id not in seen_apartment_ids:
-                a = db.get(Apartment, apt_id)
+                a = apt_map.get(apt_id)
                 if not a:
                     a = Apartment(id=apt_id, name=apt_name, planned_minutes=90, active=True)
                     db.add(a)
                 else:
                     a.name = apt_name or a.name
-                seen_apartment_ids.append(apt_id)
+                seen_apartment_ids.add(apt_id)
 
-            b = db.get(Booking, b_id)
+            b = booking_map.get(b_id)
             if not b:
-                b = Booking(id=b_id)
+                b = booking_map[b_id] = Booking(id=b_id)
                 db.add(b)
             b.apartment_id = apt_id
             b.apartment_name = apt_name or ""
-            b.arrival = (it.get("arrival") or "")[:10]
-            b.departure = (it.get("departure") or "")[:10]
+            b.arrival = arrival
+            b.departure = departure
             b.nights = int(it.get("nights") or 0)
             b.adults = int(it.get("adults") or 1)
             b.children = int(it.get("children") or 0)
@@ -1107,12 +1336,26 @@ async def refresh_bookings_job():
             else:
                 log.warning("⚠️ No guest name found for booking %d (apt: %s)", b_id, apt_name)
             
-            seen_booking_ids.append(b_id)
-
-        existing_ids = [row[0] for row in db.query(Booking.id).all()]
-        for bid in existing_ids:
-            if bid not in seen_booking_ids:
-                db.delete(db.get(Booking, bid))
+            seen_booking_ids.add(b_id)
+
+        # Übersprungene Buchungen (storniert/ungültig): Cleaner benachrichtigen, dann Buchungen + Tasks in je einem DELETE
+        skipped_ids = [bid for bid in skipped if bid not in seen_booking_ids]
+        if skipped_ids:
+            if SMTP_ENABLED:
+                cancel_mails = _build_cancellation_mails(db, {bid: skipped[bid] for bid in skipped_ids})
+            for bid in skipped_ids:
+                if bid in booking_map:
+                    log.info("🗑️ Deleted existing booking %d from database", bid)
+            db.query(Booking).filter(Booking.id.in_(skipped_ids)).delete(synchronize_session=False)
+            db.query(Task).filter(Task.booking_id.in_(skipped_ids)).delete(synchronize_session=False)
+
+        # Verwaiste Buchungen in einem DELETE entfernen; beim Teilabgleich nur innerhalb des abgerufenen Zeitraums
+        orphans = db.query(Booking)
+        if seen_booking_ids:
+            orphans = orphans.filter(~Booking.id.in_(seen_booking_ids))
+        if not full:
+            orphans = orphans.filter(Booking.arrival >= start, Booking.arrival <= end)
+        orphans.delete(synchronize_session=False)
 
         db.commit()
 
@@ -1120,14 +1363,31 @@ async def refresh_bookings_job():
         log.info("📋 Processing %d bookings from database", len(bookings))
         upsert_tasks_from_bookings(bookings)
 
-        removed = 0
-        for t in db.query(Task).all():
-            if not t.date or not t.date.strip():
-                db.delete(t); removed += 1
+        removed = (
+            db.query(Task)
+            .filter((Task.date == None) | (func.trim(Task.date) == ""))
+            .delete(synchronize_session=False)
+        )
         if removed:
             log.info("🧹 Cleanup: %d Tasks ohne Datum entfernt.", removed)
         db.commit()
-        log.info("✅ Refresh completed successfully")
+        if full:
+            app.state.last_full_sync = started
+    # Storno-Mails erst nach dem Commit und ohne offene Session verschicken (SMTP kann dauern)
+    if cancel_mails:
+        _send_cancellation_mails(cancel_mails)
+    log.info("✅ Refresh completed successfully")
+
+_refresh_lock = threading.Lock()
+
+def _refresh_bookings_locked(force_full: bool):
+    # nie zwei Abgleiche gleichzeitig (Scheduler + manueller Import)
+    with _refresh_lock:
+        _refresh_bookings_sync(force_full)
+
+async def refresh_bookings_job(force_full: bool = False):
+    # Smoobu-Abruf und DB-Arbeit sind blockierend -> im Thread, damit der Event-Loop frei bleibt
+    await asyncio.to_thread(_refresh_bookings_locked, force_full)
 
 @app.get("/", response_class=HTMLResponse)
 async def root():
@@ -1140,7 +1400,7 @@ async def health():
 @app.get("/set-language")
 async def set_language(lang: str, redirect: str = "/"):
     """Setze die Sprache als Cookie und leite weiter"""
-    if lang not in ["de", "en", "fr", "it", "es", "ro", "ru", "bg"]:
+    if lang not in _SUPPORTED:
         lang = "de"
     
     # Erstelle Response mit Redirect
@@ -1156,6 +1416,23 @@ async def set_language(lang: str, redirect: str = "/"):
     return response
 
 # -------------------- Admin UI --------------------
+def _task_booking_maps(db, tasks: list) -> tuple[dict, dict]:
+    """Gastname/Personen nur der Buchungen, auf die die angezeigten Tasks verweisen (statt aller Buchungen)"""
+    booking_ids = list({t.booking_id for t in tasks if t.booking_id})
+    book_map: Dict[int, str] = {}
+    booking_details_map: Dict[int, dict] = {}
+    if not booking_ids:
+        return book_map, booking_details_map
+    rows = (
+        db.query(Booking.id, Booking.guest_name, Booking.adults, Booking.children)
+        .filter(Booking.id.in_(booking_ids))
+    )
+    for b_id, guest_name, adults, children in rows:
+        if guest_name:
+            book_map[b_id] = guest_name.strip()
+        booking_details_map[b_id] = {'adults': adults or 0, 'children': children or 0, 'guest_name': (guest_name or "").strip()}
+    return book_map, booking_details_map
+
 @app.get("/admin/{token}")
 async def admin_home(
     request: Request,
@@ -1274,17 +1551,21 @@ async def admin_home(
     staff = db.query(Staff).filter(Staff.active==True).all()
     apts = db.query(Apartment).filter(Apartment.active==True).all()
     apt_map = {a.id: a.name for a in apts}
-    bookings = db.query(Booking).all()
-    book_map = {b.id: (b.guest_name or "").strip() for b in bookings if b.guest_name}
-    booking_details_map = {b.id: {'adults': b.adults or 0, 'children': b.children or 0, 'guest_name': (b.guest_name or "").strip()} for b in bookings}
-    log.debug("📊 Created book_map with %d entries, %d have guest names", len(bookings), len([b for b in bookings if b.guest_name and b.guest_name.strip()]))
+    book_map, booking_details_map = _task_booking_maps(db, tasks)
+    log.debug("📊 Created book_map with %d entries, %d have guest names", len(booking_details_map), len(book_map))
     
     # Timelog-Daten und Zusatzinformationen für jedes Task
+    # TimeLogs aller angezeigten Tasks mit einer Abfrage laden statt einer Abfrage pro Task
+    task_ids = [t.id for t in tasks]
+    tls_by_task: Dict[int, list] = {}
+    if task_ids:
+        for tl in db.query(TimeLog).filter(TimeLog.task_id.in_(task_ids)):
+            tls_by_task.setdefault(tl.task_id, []).append(tl)
     timelog_map = {}
     extras_map: Dict[int, Dict[str, bool]] = {}
     for t in tasks:
         # Summiere alle TimeLogs für diesen Task (nicht nur den letzten)
-        all_tls = db.query(TimeLog).filter(TimeLog.task_id==t.id).all()
+        all_tls = tls_by_task.get(t.id, ())
         total_minutes = 0
         latest_tl = None
         for tl in all_tls:
@@ -1305,7 +1586,7 @@ async def admin_home(
         except Exception:
             extras_map[t.id] = {}
     
-    base_url = BASE_URL.rstrip("/")
+    base_url = PUBLIC_BASE_URL
     if not base_url:
         base_url = f"{request.url.scheme}://{request.url.hostname}" + (f":{request.url.port}" if request.url.port else "")
     # Prüfe, ob der Token zu einem Admin-Staff gehört (für Switch-Link)
@@ -1346,7 +1627,7 @@ async def admin_series_list(request: Request, token: str, db=Depends(get_db)):
     apts = {a.id: a.name for a in db.query(Apartment).all()}
     staff = db.query(Staff).order_by(Staff.name).all()
     lang = detect_language(request); trans = get_translations(lang)
-    base_url = BASE_URL.rstrip("/") or (f"{request.url.scheme}://{request.url.hostname}" + (f":{request.url.port}" if request.url.port else ""))
+    base_url = PUBLIC_BASE_URL or (f"{request.url.scheme}://{request.url.hostname}" + (f":{request.url.port}" if request.url.port else ""))
     return templates.TemplateResponse("admin_series.html", {"request": request, "token": token, "series": series, "apartments": apts, "staff": staff, "base_url": base_url, "lang": lang, "trans": trans})
 
 @app.post("/admin/{token}/series/add")
@@ -1399,9 +1680,9 @@ async def admin_series_add(
     )
     db.add(s); db.commit()
     # expand immediately a bit
-    expand_series_job(days_ahead=30)
+    await asyncio.to_thread(expand_series_job, days_ahead=30)
     try:
-        send_assignment_emails_job()
+        await asyncio.to_thread(send_assignment_emails_job)
     except Exception as e:
         log.error("notify after series add failed: %s", e)
     # korrekt auf die Seite mit deinem echten Token umleiten
@@ -1490,10 +1771,10 @@ async def admin_series_update(
 @app.get("/admin/{token}/series/expand")
 async def admin_series_expand(token: str, days: int = 30):
     if token != ADMIN_TOKEN: raise HTTPException(status_code=403)
-    created = expand_series_job(days_ahead=days)
+    created = await asyncio.to_thread(expand_series_job, days_ahead=days)
     try:
         if created:
-            send_assignment_emails_job()
+            await asyncio.to_thread(send_assignment_emails_job)
     except Exception as e:
         log.error("notify after series expand failed: %s", e)
     return PlainTextResponse(f"Created {created} tasks for next {days} days.")
@@ -1537,15 +1818,8 @@ async def admin_staff(request: Request, token: str, db=Depends(get_db)):
     last_start, last_end = month_range(last_month[0], last_month[1])
     curr_start, curr_end = month_range(today.year, today.month)
     
-    staff_hours = {}
-    for s in staff:
-        # Hole alle TimeLog-Einträge für diesen Mitarbeiter mit actual_minutes
-        logs = db.query(TimeLog).filter(
-            TimeLog.staff_id == s.id,
-            TimeLog.actual_minutes != None
-        ).all()
-        
-        hours_data = {
+    staff_hours = {
+        s.id: {
             'prev_last_month': 0.0,
             'last_month': 0.0,
             'current_month': 0.0,
@@ -1556,37 +1830,41 @@ async def admin_staff(request: Request, token: str, db=Depends(get_db)):
             'last_total': 0.0,
             'current_total': 0.0,
         }
-        
-        for tl in logs:
-            if not tl.started_at:
-                continue
-            
-            # Extrahiere Monat aus started_at (Format: "yyyy-mm-dd HH:MM:SS")
-            month_str = tl.started_at[:7]  # "yyyy-mm"
-            minutes = int(tl.actual_minutes or 0)
-            hours = round(minutes / 60.0, 2)
-            
-            if month_str == prev_last_month_str:
-                hours_data['prev_last_month'] += hours
-            elif month_str == last_month_str:
-                hours_data['last_month'] += hours
-            elif month_str == current_month:
-                hours_data['current_month'] += hours
-        
-        # Geplante Zeiten aus Tasks (planned_minutes)
-        def planned_hours_for_range(start_iso: str, end_iso: str) -> float:
-            tasks = db.query(Task).filter(
-                Task.assigned_staff_id == s.id,
-                Task.date >= start_iso,
-                Task.date <= end_iso,
-            ).all()
-            minutes = sum(int(t.planned_minutes or 0) for t in tasks)
-            return round(minutes / 60.0, 2)
-
-        hours_data['prev_last_planned'] = planned_hours_for_range(prev_start, prev_end)
-        hours_data['last_planned'] = planned_hours_for_range(last_start, last_end)
-        hours_data['current_planned'] = planned_hours_for_range(curr_start, curr_end)
+        for s in staff
+    }
 
+    # Ist-Zeiten aller Mitarbeiter für die drei Monate in einer Abfrage (statt einer pro Mitarbeiter)
+    actual_keys = {prev_last_month_str: 'prev_last_month', last_month_str: 'last_month', current_month: 'current_month'}
+    logs = (
+        db.query(TimeLog.staff_id, TimeLog.started_at, TimeLog.actual_minutes)
+        .filter(TimeLog.actual_minutes != None, func.substr(TimeLog.started_at, 1, 7).in_(list(actual_keys)))
+        .all()
+    )
+    for sid, started_at, actual_minutes in logs:
+        hours_data = staff_hours.get(sid)
+        # Monat aus started_at (Format: "yyyy-mm-dd HH:MM:SS")
+        key = actual_keys.get(started_at[:7])
+        if hours_data is None or key is None:
+            continue
+        hours_data[key] += round(int(actual_minutes or 0) / 60.0, 2)
+
+    # Geplante Zeiten aus Tasks (planned_minutes), gruppiert nach Mitarbeiter und Monat
+    planned_keys = {prev_last_month_str: 'prev_last_planned', last_month_str: 'last_planned', current_month: 'current_planned'}
+    ym = func.substr(Task.date, 1, 7)
+    planned = (
+        db.query(Task.assigned_staff_id, ym, func.sum(func.coalesce(Task.planned_minutes, 0)))
+        .filter(Task.assigned_staff_id != None, Task.date >= prev_start, Task.date <= curr_end)
+        .group_by(Task.assigned_staff_id, ym)
+        .all()
+    )
+    for sid, month_str, minutes in planned:
+        hours_data = staff_hours.get(sid)
+        key = planned_keys.get(month_str)
+        if hours_data is None or key is None:
+            continue
+        hours_data[key] = round(int(minutes or 0) / 60.0, 2)
+
+    for hours_data in staff_hours.values():
         # Gesamtsummen (geleistet + geplant)
         hours_data['prev_last_total'] = round(hours_data['prev_last_month'] + hours_data['prev_last_planned'], 2)
         hours_data['last_total'] = round(hours_data['last_month'] + hours_data['last_planned'], 2)
@@ -1596,10 +1874,8 @@ async def admin_staff(request: Request, token: str, db=Depends(get_db)):
         hours_data['prev_last_month'] = round(hours_data['prev_last_month'], 2)
         hours_data['last_month'] = round(hours_data['last_month'], 2)
         hours_data['current_month'] = round(hours_data['current_month'], 2)
-        
-        staff_hours[s.id] = hours_data
     
-    base_url = BASE_URL.rstrip("/")
+    base_url = PUBLIC_BASE_URL
     if not base_url:
         base_url = f"{request.url.scheme}://{request.url.hostname}" + (f":{request.url.port}" if request.url.port else "")
     return templates.TemplateResponse("admin_staff.html", {"request": request, "token": token, "staff": staff, "staff_hours": staff_hours, "current_month": current_month, "last_month": last_month_str, "prev_last_month": prev_last_month_str, "base_url": base_url, "lang": lang, "trans": trans})
@@ -1610,7 +1886,7 @@ async def admin_staff_add(token: str, name: str = Form(...), email: str = Form(.
     email = (email or "").strip()
     if not email or "@" not in email:
         raise HTTPException(status_code=400, detail="E-Mail ist erforderlich")
-    if language not in ["de","en","fr","it","es","ro","ru","bg"]:
+    if language not in _SUPPORTED:
         language = "de"
     phone = (phone or "").strip()
     s = Staff(name=name, email=email, phone=phone, hourly_rate=hourly_rate, max_hours_per_month=max_hours_per_month, magic_token=new_token(16), active=True, language=language, is_admin=bool(is_admin))
@@ -1644,7 +1920,7 @@ async def admin_staff_update(
     email = (email or "").strip()
     if not email or "@" not in email:
         raise HTTPException(status_code=400, detail="Ungültige E-Mail")
-    if language not in ["de","en","fr","it","es","ro","ru","bg"]:
+    if language not in _SUPPORTED:
         language = "de"
     phone = (phone or "").strip()
     s.name = name
@@ -1695,7 +1971,7 @@ async def admin_task_assign(request: Request, token: str, task_id: int = Form(..
     # Sofortige Mail bei neuer/ändernder Zuweisung
     try:
         if staff_id and staff_id != prev_staff_id:
-            send_assignment_emails_job()
+            await asyncio.to_thread(send_assignment_emails_job)
     except Exception as e:
         log.error("Immediate notify failed for task %s: %s", t.id, e)
     # Behalte Filter-Parameter bei
@@ -1780,7 +2056,7 @@ async def admin_task_create(
     # Wenn ein MA ausgewählt wurde, direkt Benachrichtigung auslösen
     if staff_id_val:
         try:
-            send_assignment_emails_job()
+            await asyncio.to_thread(send_assignment_emails_job)
         except Exception as e:
             log.error("Fehler beim Senden der Zuweisungs-Benachrichtigung für manuelle Aufgabe %s: %s", new_task.id, e)
 
@@ -1862,7 +2138,7 @@ async def admin_task_update_manual(token: str, task_id: int = Form(...), date: s
     # Wenn ein neuer MA zugewiesen wurde (oder geändert), Benachrichtigung senden
     if staff_id_val and staff_id_val != prev_staff_id:
         try:
-            send_assignment_emails_job()
+            await asyncio.to_thread(send_assignment_emails_job)
         except Exception as e:
             log.error("Fehler beim Senden der Zuweisungs-Benachrichtigung nach Update: %s", e)
     
@@ -1937,7 +2213,7 @@ async def admin_task_extras(
     t.extras_json = json.dumps(extras)
     db.commit()
     if (request.headers.get("x-requested-with") or "").lower() == "fetch":
-        return JSONResponse({"ok": True, "task_id": t.id, "field": field, "value": response_value})
+        return ORJSONResponse({"ok": True, "task_id": t.id, "field": field, "value": response_value})
     target = redirect or request.headers.get("referer") or f"/admin/{token}"
     return RedirectResponse(url=target, status_code=303)
 
@@ -1989,7 +2265,7 @@ async def admin_apartments_apply(token: str, apartment_id: int = Form(...), db=D
 @app.get("/admin/{token}/import")
 async def admin_import(token: str, db=Depends(get_db)):
     if token != ADMIN_TOKEN: raise HTTPException(status_code=403)
-    await refresh_bookings_job()
+    await refresh_bookings_job(force_full=True)
     return PlainTextResponse("Import done.")
 
 @app.get("/admin/{token}/test_whatsapp")
@@ -2006,12 +2282,9 @@ async def admin_test_whatsapp(token: str, phone: str = Query(...), db=Depends(ge
         "TWILIO_WHATSAPP_FROM": TWILIO_WHATSAPP_FROM if TWILIO_WHATSAPP_FROM else "❌ nicht gesetzt",
     }
     
-    try:
-        from twilio.rest import Client
-        twilio_installed = "✅ installiert"
-    except ImportError:
-        twilio_installed = "❌ nicht installiert"
+    if _TwilioClient is None:
         return PlainTextResponse(f"❌ Twilio Library nicht installiert")
+    twilio_installed = "✅ installiert"
     
     # Versuche Nachricht zu senden und hole Details
     result = False
@@ -2028,8 +2301,9 @@ async def admin_test_whatsapp(token: str, phone: str = Query(...), db=Depends(ge
                 normalized_phone = "+49" + normalized_phone
         whatsapp_to = f"whatsapp:{normalized_phone}"
         
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-        message_obj = client.messages.create(
+        client = _twilio_client()
+        message_obj = await asyncio.to_thread(
+            client.messages.create,
             body=test_msg,
             from_=TWILIO_WHATSAPP_FROM,
             to=whatsapp_to
@@ -2177,23 +2451,28 @@ async def twilio_message_webhook(request: Request, db=Depends(get_db)):
         log.error("Error processing Twilio message webhook: %s", e, exc_info=True)
         return Response(status_code=500)
 
+def _report_text(title: str, report: list, staff_line) -> str:
+    """Menschenlesbarer Report für die manuellen Benachrichtigungs-Endpunkte"""
+    lines = [title, ""]
+    for r in report:
+        lines.append(staff_line(r))
+        for it in r['items']:
+            guest = f" · {it.guest}" if it.guest else ""
+            lines.append(f"  • {it.date} · {it.apt} · {it.desc}{guest}")
+        lines.append("")
+    return "\n".join(lines).strip()
+
 @app.get("/admin/{token}/notify_assignments")
 async def admin_notify_assignments(token: str):
     if token != ADMIN_TOKEN:
         raise HTTPException(status_code=403)
     try:
-        report = send_assignment_emails_job()
+        # Versand blockiert (SMTP), daher nicht im Event-Loop
+        report = await asyncio.to_thread(send_assignment_emails_job)
         if not report:
             return PlainTextResponse("Keine offenen Zuweisungen zum Versenden.")
-        # Baue menschenlesbaren Report
-        lines = ["Benachrichtigungen gesendet:", ""]
-        for r in report:
-            lines.append(f"- {r['staff_name']} <{r['email']}>: {r['count']} Aufgaben")
-            for it in r['items']:
-                guest = f" · {it['guest']}" if it.get('guest') else ""
-                lines.append(f"  • {it['date']} · {it['apt']} · {it['desc']}{guest}")
-            lines.append("")
-        return PlainTextResponse("\n".join(lines).strip())
+        return PlainTextResponse(_report_text("Benachrichtigungen gesendet:", report,
+                                              lambda r: f"- {r['staff_name']} <{r['email']}>: {r['count']} Aufgaben"))
     except Exception as e:
         log.exception("Manual notify failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
@@ -2204,18 +2483,11 @@ async def admin_notify_whatsapp_existing(token: str):
     if token != ADMIN_TOKEN:
         raise HTTPException(status_code=403)
     try:
-        report = send_whatsapp_for_existing_assignments()
+        report = await asyncio.to_thread(send_whatsapp_for_existing_assignments)
         if not report:
             return PlainTextResponse("Keine bestehenden Zuweisungen mit Telefonnummern gefunden.")
-        # Baue menschenlesbaren Report
-        lines = ["WhatsApp-Benachrichtigungen für bestehende Zuweisungen:", ""]
-        for r in report:
-            lines.append(f"- {r['staff_name']} ({r['phone']}): {r['count']} Aufgaben")
-            for it in r['items']:
-                guest = f" · {it['guest']}" if it.get('guest') else ""
-                lines.append(f"  • {it['date']} · {it['apt']} · {it['desc']}{guest}")
-            lines.append("")
-        return PlainTextResponse("\n".join(lines).strip())
+        return PlainTextResponse(_report_text("WhatsApp-Benachrichtigungen für bestehende Zuweisungen:", report,
+                                              lambda r: f"- {r['staff_name']} ({r['phone']}): {r['count']} Aufgaben"))
     except Exception as e:
         log.exception("WhatsApp notify existing failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
@@ -2241,8 +2513,9 @@ async def admin_cleanup(token: str, db=Depends(get_db)):
     if token != ADMIN_TOKEN: raise HTTPException(status_code=403)
     
     removed_count = 0
-    all_bookings = {b.id for b in db.query(Booking).all()}
-    log.info("🔍 Cleanup started. Checking %d tasks against %d bookings", db.query(Task).count(), len(all_bookings))
+    # Alle Buchungen einmal laden statt db.get() pro Task
+    booking_map = {b.id: b for b in db.query(Booking).all()}
+    log.info("🔍 Cleanup started. Checking %d tasks against %d bookings", db.query(Task).count(), len(booking_map))
     
     # Finde ALLE ungültigen Tasks
     for t in db.query(Task).all():
@@ -2251,10 +2524,10 @@ async def admin_cleanup(token: str, db=Depends(get_db)):
         
         # Nur auto-generierte Tasks prüfen
         if t.auto_generated and t.booking_id:
-            b = db.get(Booking, t.booking_id)
+            b = booking_map.get(t.booking_id)
             
             # Wenn Buchung nicht mehr existiert
-            if not b or t.booking_id not in all_bookings:
+            if not b:
                 should_delete = True
                 reason = f"booking {t.booking_id} does not exist"
             # Wenn Buchung kein departure hat
@@ -2292,10 +2565,11 @@ async def admin_export(token: str, month: str, db=Depends(get_db)):
     if token != ADMIN_TOKEN: raise HTTPException(status_code=403)
     apts = db.query(Apartment).all()
     apt_map = {a.id: a.name for a in apts}
+    staff_map = {s.id: s for s in db.query(Staff).all()}
     rows = []
     for t in db.query(Task).order_by(Task.date, Task.id).all():
         if not t.date.startswith(month): continue
-        staff = db.get(Staff, t.assigned_staff_id) if t.assigned_staff_id else None
+        staff = staff_map.get(t.assigned_staff_id) if t.assigned_staff_id else None
         rate = float(staff.hourly_rate) if staff else 0.0
         actual = 0
         tl = db.query(TimeLog).filter(TimeLog.task_id==t.id, TimeLog.actual_minutes!=None).order_by(TimeLog.id.desc()).first()
@@ -2328,7 +2602,8 @@ async def admin_export(token: str, month: str, db=Depends(get_db)):
 async def cleaner_home(request: Request, token: str, show_done: int = 1, show_open: int = 1, db=Depends(get_db)):
     s = db.query(Staff).filter(Staff.magic_token==token, Staff.active==True).first()
     if not s: raise HTTPException(status_code=403)
-    q = db.query(Task).filter(Task.assigned_staff_id==s.id)
+    # TimeLogs der Tasks in einer zusätzlichen IN-Abfrage mitladen statt zwei Abfragen pro Task
+    q = db.query(Task).options(selectinload(Task.timelogs)).filter(Task.assigned_staff_id==s.id)
     # Abgelehnte Tasks ausblenden - zeige nur Tasks die nicht rejected sind
     from sqlalchemy import or_
     q = q.filter(or_(Task.assignment_status != "rejected", Task.assignment_status.is_(None)))
@@ -2346,9 +2621,7 @@ async def cleaner_home(request: Request, token: str, show_done: int = 1, show_op
     tasks = q.order_by(Task.date, Task.id).all()
     apts = db.query(Apartment).all()
     apt_map = {a.id: a.name for a in apts}
-    bookings = db.query(Booking).all()
-    book_map = {b.id: (b.guest_name or "").strip() for b in bookings if b.guest_name}
-    booking_details_map = {b.id: {'adults': b.adults or 0, 'children': b.children or 0, 'guest_name': (b.guest_name or "").strip()} for b in bookings}
+    book_map, booking_details_map = _task_booking_maps(db, tasks)
     # Stunden: vorletzter, letzter, aktueller Monat
     today = dt.date.today()
     current_month_str = today.strftime("%Y-%m")
@@ -2384,22 +2657,23 @@ async def cleaner_home(request: Request, token: str, show_done: int = 1, show_op
     hours_prev_last = round(minutes_prev_last/60.0, 2)
     used_hours = hours_current
     run_map: Dict[int, str] = {}
-    for t in tasks:
-        tl = db.query(TimeLog).filter(TimeLog.task_id==t.id, TimeLog.staff_id==s.id, TimeLog.ended_at==None).order_by(TimeLog.id.desc()).first()
-        if tl:
-            run_map[t.id] = tl.started_at
-    has_running = any(t.status == 'running' for t in tasks)
-    warn_limit = used_hours > float(s.max_hours_per_month or 0)
     # Timelog-Daten für jedes Task (für pausierte Aufgaben)
     timelog_map = {}
     for t in tasks:
-        tl = db.query(TimeLog).filter(TimeLog.task_id==t.id, TimeLog.staff_id==s.id).order_by(TimeLog.id.desc()).first()
-        if tl:
+        # t.timelogs ist nach id sortiert -> der letzte eigene Eintrag ist der neueste
+        own = [tl for tl in t.timelogs if tl.staff_id == s.id]
+        running = [tl for tl in own if tl.ended_at is None]
+        if running:
+            run_map[t.id] = running[-1].started_at
+        if own:
+            tl = own[-1]
             timelog_map[t.id] = {
                 'actual_minutes': tl.actual_minutes,
                 'started_at': tl.started_at,
                 'ended_at': tl.ended_at
             }
+    has_running = any(t.status == 'running' for t in tasks)
+    warn_limit = used_hours > float(s.max_hours_per_month or 0)
     extras_map: Dict[int, Dict[str, object]] = {}
     for t in tasks:
         try:
@@ -2604,7 +2878,7 @@ async def cleaner_note(token: str, task_id: int = Form(...), note: str = Form(""
     t = db.get(Task, task_id)
     t.notes = (note or "").strip()
     db.commit()
-    return JSONResponse({"ok": True, "task_id": t.id, "note": t.notes})
+    return ORJSONResponse({"ok": True, "task_id": t.id, "note": t.notes})
 
 @app.post("/cleaner/{token}/task/create")
 async def cleaner_task_create(token: str, date: str = Form(...), planned_minutes: int = Form(90), description: str = Form(""), db=Depends(get_db)):
@@ -2688,8 +2962,8 @@ def _is_admin_token(token: str, db) -> bool:
 @app.get("/push/public_key")
 async def push_public_key():
     if not VAPID_PUBLIC_KEY:
-        return JSONResponse({"publicKey": ""})
-    return JSONResponse({"publicKey": VAPID_PUBLIC_KEY})
+        return ORJSONResponse({"publicKey": ""})
+    return ORJSONResponse({"publicKey": VAPID_PUBLIC_KEY})
 
 @app.post("/push/subscribe")
 async def push_subscribe(request: Request, staff_token: Optional[str] = Query(None), db=Depends(get_db)):
@@ -2717,7 +2991,7 @@ async def push_subscribe(request: Request, staff_token: Optional[str] = Query(No
         sub = PushSubscription(staff_id=staff_id, endpoint=endpoint, p256dh=p256dh, auth=auth, user_agent=ua, created_at=now)
         db.add(sub)
     db.commit()
-    return JSONResponse({"ok": True})
+    return ORJSONResponse({"ok": True})
 
 @app.post("/push/unsubscribe")
 async def push_unsubscribe(request: Request, db=Depends(get_db)):
@@ -2729,7 +3003,7 @@ async def push_unsubscribe(request: Request, db=Depends(get_db)):
     if sub:
         db.delete(sub)
         db.commit()
-    return JSONResponse({"ok": True})
+    return ORJSONResponse({"ok": True})
 
 def _send_webpush_to_subscription(sub: PushSubscription, payload: dict):
     if not VAPID_PUBLIC_KEY or not VAPID_PRIVATE_KEY:
@@ -2742,7 +3016,7 @@ def _send_webpush_to_subscription(sub: PushSubscription, payload: dict):
                 "keys": {"p256dh": sub.p256dh, "auth": sub.auth},
             },
             data=json.dumps(payload),
-            vapid_private_key=VAPID_PRIVATE_KEY,
+            vapid_private_key=getattr(app.state, "vapid_key", None) or VAPID_PRIVATE_KEY,
             vapid_claims={"sub": VAPID_EMAIL},
             ttl=60,
         )
@@ -2759,8 +3033,10 @@ async def admin_push_test(token: str, staff_id: Optional[int] = Form(None), db=D
     if staff_id:
         q = q.filter(PushSubscription.staff_id==staff_id)
     subs = q.all()
-    sent = 0
-    for sub in subs:
-        ok = _send_webpush_to_subscription(sub, {"title": "Test", "body": "Web Push funktioniert.", "url": f"/admin/{token}"})
-        if ok: sent += 1
-    return JSONResponse({"ok": True, "sent": sent})
+    payload = {"title": "Test", "body": "Web Push funktioniert.", "url": f"/admin/{token}"}
+    # Push-Requests parallel im Worker-Pool, ohne den Event-Loop zu blockieren
+    results = await asyncio.gather(*(
+        asyncio.wrap_future(_notify_pool.submit(_send_webpush_to_subscription, sub, payload)) for sub in subs
+    ))
+    sent = sum(1 for ok in results if ok)
+    return ORJSONResponse({"ok": True, "sent": sent})
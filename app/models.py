@@ -1,6 +1,6 @@
 
-from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import String, Integer, Float, Boolean, ForeignKey, Text
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy import String, Integer, Float, Boolean, ForeignKey, Text, Index
 from .db import Base
 
 class TaskSeries(Base):
@@ -83,6 +83,16 @@ class Task(Base):
     next_arrival_comments: Mapped[str | None] = mapped_column(Text, nullable=True)
     next_arrival_guest_name: Mapped[str | None] = mapped_column(String(255), nullable=True)
 
+    # Nur lesend, für selectinload in Listenansichten (Löschen/Anlegen läuft weiter über task_id)
+    timelogs: Mapped[list["TimeLog"]] = relationship(order_by="TimeLog.id", viewonly=True)
+
+    __table_args__ = (
+        # Treiber-Abfrage des Benachrichtigungs-Jobs (pending, zugewiesen, noch nicht benachrichtigt)
+        Index("ix_tasks_pending_notify", "assignment_status", "assigned_staff_id", "assign_notified_at"),
+        # Zeitraum-Filter/Sortierung der Listen (ISO-Strings sortieren wie Datumswerte)
+        Index("ix_tasks_date", "date"),
+    )
+
 class TimeLog(Base):
     __tablename__ = "timelogs"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
@@ -1,15 +1,21 @@
 
 import os, requests, logging
 from typing import Any
+from requests.adapters import HTTPAdapter
 
 BASE_URL = os.getenv("SMOOBU_BASE_URL", "https://login.smoobu.com/api")
 API_KEY = os.getenv("SMOOBU_API_KEY", "")
 log = logging.getLogger("smoobu")
 
+# Eine Session für alle Clients: Keep-Alive statt neuem TCP/TLS-Handshake pro Refresh und Seite
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
 class SmoobuClient:
     def __init__(self, api_key: str | None = None, base_url: str | None = None):
         self.api_key = api_key or API_KEY
         self.base_url = (base_url or BASE_URL).rstrip("/")
+        self._s = _session
 
     def _headers(self) -> dict[str, str]:
         return {"Api-Key": self.api_key, "Accept": "application/json"}
@@ -19,7 +25,7 @@ class SmoobuClient:
         while True:
             url = f"{self.base_url}/reservations"
             params = {"from": date_from, "to": date_to, "pageSize": page_size, "page": page}
-            r = requests.get(url, headers=self._headers(), params=params, timeout=30)
+            r = self._s.get(url, headers=self._headers(), params=params, timeout=30)
             r.raise_for_status()
             data = r.json()
             items = data.get("bookings") or data.get("items") or []